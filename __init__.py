@@ -9,7 +9,7 @@ SCRIPT_DIR = os.path.dirname(
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 ## /
 
-from scripts.counter import CommandTracker
+from scripts.counter import CommandTracker, CounterConfig
 from api import Script, TwitchIrc, prnt, timer_callback
 
 
@@ -29,9 +29,9 @@ if __name__ == "__main__":
         "MIT",
         "Counts the number of times a command is seen",
     )
-    commandtracker_cb = testing.register_event(
-        CommandTracker("!uguu", "!quack", "!croak", "!speen")
-    )
+    counter_config = CounterConfig()
+    counterconfig_cb = testing.register_config(counter_config)
+    commandtracker_cb = testing.register_event(CommandTracker(counter_config))
     testing_shutdown = testing.shutdown
     testing.install()
 
@@ -1,14 +1,17 @@
 from abc import abstractmethod
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 import re
-from types import LambdaType
+from types import MappingProxyType
 import weechat as w
-import inspect
 from typing import (
     Any,
     Dict,
     DefaultDict,
+    Deque,
+    Iterable,
+    Iterator,
     List,
+    Mapping,
     Optional,
     Pattern,
     Set,
@@ -17,15 +20,49 @@ from typing import (
     TypedDict,
     Callable,
     Union,
+    cast,
 )
-from enum import Enum
+from enum import Enum, IntEnum
 from datetime import datetime
-from uuid import uuid4
-from pprint import pformat, pprint
+import os
+from itertools import count
+from time import monotonic, perf_counter, time
 
-from pydle.features.ircv3.tags import TaggedMessage
-from pydle.features.ctcp import is_ctcp, construct_ctcp, parse_ctcp
-from pydle.features.rfc1459.parsing import parse_user
+# pydle (api.parsing), inspect (api.debug) and json are slow to import and
+# only needed once a line is parsed, a hook is installed or state is saved, so
+# they're imported on first use to keep script load short. Submodules that
+# aren't imported here are re-exported lazily by __getattr__ at the bottom.
+
+
+def _parse_line(line: str):
+    global _parse_line
+    from api.parsing import parse_line
+
+    _parse_line = parse_line
+    return parse_line(line)
+
+
+_TAG_ESCAPES = str.maketrans(
+    {"\\": "\\\\", ";": "\\:", " ": "\\s", "\r": "\\r", "\n": "\\n"}
+)
+_write_buffer = bytearray()
+
+_ASCII_UPPER = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_ASCII_LOWER = b"abcdefghijklmnopqrstuvwxyz"
+
+# Byte translation tables for the CASEMAPPING values servers advertise in
+# ISUPPORT. They only map ASCII, so they're safe to apply to UTF-8, and
+# bytes.translate is several times faster than str.translate with a dict.
+CASEMAPPINGS: Dict[str, bytes] = {
+    "ascii": bytes.maketrans(_ASCII_UPPER, _ASCII_LOWER),
+    "rfc1459": bytes.maketrans(_ASCII_UPPER + b"[]\\~", _ASCII_LOWER + b"{}|^"),
+    "strict-rfc1459": bytes.maketrans(_ASCII_UPPER + b"[]\\", _ASCII_LOWER + b"{}|"),
+}
+
+
+def casefold(text: str, casemapping: str) -> str:
+    """Normalize a nick or channel name so equal names compare equal"""
+    return text.encode().translate(CASEMAPPINGS[casemapping]).decode()
 
 
 class IrcMessage:
@@ -36,31 +73,12 @@ class IrcMessage:
     source: str
     command: str
     params: List[str]
-    tags: Dict[str, str]
 
-    def __init__(self, server: str, line: str):
-        msg = TaggedMessage.parse(line.encode())
-
-        source = msg.source
-        nick, user, host = parse_user(source)
+    _keys: Optional[Dict[int, Tuple[str, str, str]]] = None
+    _tags: Optional[Dict[str, str]] = None
 
-        if isinstance(msg.command, int):
-            command = f"{msg.command:03}"
-        else:
-            command = msg.command.upper()
-
-        params = msg.params
-
-        if command == "PRIVMSG":
-            if is_ctcp(params[1]):
-                type, params = parse_ctcp(params[1])
-                command = f"CTCP_{type.upper()}"
-                params[1] = params
-        elif command == "NOTICE":
-            if is_ctcp(msg.params[1]):
-                type, params = parse_ctcp(params[1])
-                command = f"CTCPREPLY_{type.upper()}"
-                params[1] = params
+    def __init__(self, server: str, line: str):
+        source, nick, user, host, command, params, tags = _parse_line(line)
 
         self.server = server
         self._source = source
@@ -69,50 +87,175 @@ class IrcMessage:
         self.host = host
         self.command = command
         self.params = params
-        self.tags = msg.tags
 
-    def __str__(self):
+        self._raw = line.rstrip("\r\n")
+        self._raw_fields = (nick, user, host, command)
+        self._raw_params = tuple(params)
+        self._raw_tags = tags
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        """The message tags, copied from the parsed line on first access
+
+        Most handlers never look at the tags, so the copy `modified` compares
+        against is only made for messages whose tags could have changed.
+        """
+        tags = self._tags
+        if tags is None:
+            tags = self._tags = dict(self._raw_tags)
+        return tags
+
+    @tags.setter
+    def tags(self, tags: Dict[str, str]):
+        self._tags = tags
+
+    def _peek_tags(self) -> Mapping[str, str]:
+        """The current tags for reading, without making the copy `tags` does"""
+        tags = self._tags
+        return tags if tags is not None else self._raw_tags
+
+    @property
+    def modified(self) -> bool:
+        """Whether the message differs from the line it was parsed from"""
+        return (
+            (self.nick, self.user, self.host, self.command) != self._raw_fields
+            or tuple(self.params) != self._raw_params
+            or (self._tags is not None and self._tags != self._raw_tags)
+        )
+
+    def key(self, idx: int, casemapping: str) -> str:
+        """`params[idx]` folded with `casemapping`, computed once per message
+
+        Casemapped matchers compare against this, so several handlers matching
+        the same target don't each normalize it again.
+        """
+        value = self.params[idx]
+        keys = self._keys
+        if keys is None:
+            keys = self._keys = {}
+        cached = keys.get(idx)
+        if cached is not None and cached[0] is value and cached[1] == casemapping:
+            return cached[2]
+        folded = casefold(value, casemapping)
+        keys[idx] = (value, casemapping, folded)
+        return folded
+
+    def write(self, buf: bytearray) -> None:
+        """Append the wire form of this message, including CRLF, to `buf`
+
+        Args:
+            buf (bytearray): Buffer to append to; it is not cleared first
+        """
+        if not self.modified:
+            buf += self._raw.encode()
+            buf += b"\r\n"
+            return
+
         command = self.command
         params = self.params
-        type = None
+        if command.startswith("CTCP"):
+            from api.parsing import construct_ctcp
         if command.startswith("CTCP_"):
+            params = [*params[:1], construct_ctcp(command[5:], *params[1:])]
             command = "PRIVMSG"
-            type = command.split("_")[1]
-        if command.startswith("CTCPREPLY_"):
+        elif command.startswith("CTCPREPLY_"):
+            params = [*params[:1], construct_ctcp(command[10:], *params[1:])]
             command = "NOTICE"
-            type = command.split("_")[1]
 
-        parts = []
-        if self.tags and len(self.tags) > 0:
-            serialized = ";".join([f"{k}={v}" for k, v in self.tags.items()])
-            parts.append(f"@{serialized}")
+        if self.tags:
+            sep = b"@"
+            for k, v in self.tags.items():
+                buf += sep
+                buf += k.encode()
+                if v is not None and v is not True and v != "":
+                    buf += b"="
+                    buf += str(v).translate(_TAG_ESCAPES).encode()
+                sep = b";"
+            buf += b" "
 
-        source = ""
         if self.nick:
-            source += self.nick
-        if self.user:
-            source += f"!{self.user}"
-        if self.host:
-            source += f"@{self.host}"
-
-        if source:
-            parts.append(f":{source}")
-
-        parts.append(self.command)
-
-        if params:
-            params = self.params
-            if type and len(params) == 1:
-                params[1] = construct_ctcp(type)
-            elif type:
-                params[1] = construct_ctcp(type, params[1])
-
-            if len(params) > 1:
-                parts.append(f":{' '.join(params)}")
-            elif len(params) == 1:
-                parts.append(params[0])
+            buf += b":"
+            buf += self.nick.encode()
+            if self.user:
+                buf += b"!"
+                buf += self.user.encode()
+            if self.host:
+                buf += b"@"
+                buf += self.host.encode()
+            buf += b" "
+
+        buf += command.encode()
+
+        last = len(params) - 1
+        for idx, param in enumerate(params):
+            buf += b" "
+            if idx == last and (not param or param[0] == ":" or " " in param):
+                buf += b":"
+            buf += param.encode()
+
+        buf += b"\r\n"
 
-        return f"{' '.join(parts)}\r\n"
+    def __str__(self):
+        if not self.modified:
+            return self._raw
+
+        buf = _write_buffer
+        del buf[:]
+        self.write(buf)
+        return buf[:-2].decode()
+
+
+Badges = Mapping[str, str]
+EmoteRanges = Tuple[Tuple[str, Tuple[Tuple[int, int], ...]], ...]
+
+_EMPTY_BADGES: Badges = MappingProxyType({})
+_badge_cache: Dict[str, Badges] = {}
+_emote_cache: Dict[str, EmoteRanges] = {}
+_TAG_CACHE_SIZE = 4096
+
+
+def decode_badges(raw: str) -> Badges:
+    """Decode a `badges` or `badge-info` tag, e.g. `moderator/1,subscriber/12`
+
+    Results are cached by raw value and shared, so they are read-only.
+    """
+    badges = _badge_cache.get(raw)
+    if badges is None:
+        decoded: Dict[str, str] = {}
+        for badge in raw.split(","):
+            if badge:
+                name, _, version = badge.partition("/")
+                decoded[name] = version
+        badges = MappingProxyType(decoded)
+        if len(_badge_cache) >= _TAG_CACHE_SIZE:
+            _badge_cache.clear()
+        _badge_cache[raw] = badges
+    return badges
+
+
+def decode_emotes(raw: str) -> EmoteRanges:
+    """Decode an `emotes` tag, e.g. `25:0-4,12-16/1902:6-10`
+
+    Returns (emote id, ((start, end), ...)) pairs with inclusive code point
+    offsets into the message text. Results are cached by raw value.
+    """
+    emotes = _emote_cache.get(raw)
+    if emotes is None:
+        decoded = []
+        for emote in raw.split("/"):
+            emote_id, _, ranges = emote.partition(":")
+            if not ranges:
+                continue
+            spans = []
+            for span in ranges.split(","):
+                start, _, end = span.partition("-")
+                spans.append((int(start), int(end)))
+            decoded.append((emote_id, tuple(spans)))
+        emotes = tuple(decoded)
+        if len(_emote_cache) >= _TAG_CACHE_SIZE:
+            _emote_cache.clear()
+        _emote_cache[raw] = emotes
+    return emotes
 
 
 class TwitchMessage(IrcMessage):
@@ -120,46 +263,233 @@ class TwitchMessage(IrcMessage):
 
     def __init__(self, server: str, line: str):
         super().__init__(server, line)
-        if "display-name" in self.tags:
-            self.display_name = self.tags["display-name"]
+        tags = self._raw_tags
+        if "display-name" in tags:
+            self.display_name = tags["display-name"]
         else:
             self.display_name = self.nick
 
+    def _tag(self, name: str) -> str:
+        value = self._peek_tags().get(name)
+        return value if isinstance(value, str) else ""
+
+    @property
+    def badges(self) -> Badges:
+        """Badge name to version, decoded from the `badges` tag on first use"""
+        raw = self._tag("badges")
+        return decode_badges(raw) if raw else _EMPTY_BADGES
+
+    @property
+    def badge_info(self) -> Badges:
+        """Badge name to detail (e.g. subscriber months) from `badge-info`"""
+        raw = self._tag("badge-info")
+        return decode_badges(raw) if raw else _EMPTY_BADGES
+
+    @property
+    def emotes(self) -> EmoteRanges:
+        """Emote ids and their (start, end) code point ranges in the text"""
+        raw = self._tag("emotes")
+        return decode_emotes(raw) if raw else ()
+
+    @property
+    def emote_only(self) -> bool:
+        """Whether the text consists of nothing but emotes and spaces"""
+        flag = self._tag("emote-only")
+        if flag:
+            return flag == "1"
+
+        emotes = self.emotes
+        if not emotes or len(self.params) < 2:
+            return False
+
+        text = self.params[-1]
+        length = len(text)
+        pos = 0
+        for start, end in sorted(r for _, ranges in emotes for r in ranges):
+            # ranges can point past the text, e.g. after a modifier shortened it
+            while pos < min(start, length):
+                if text[pos] != " ":
+                    return False
+                pos += 1
+            pos = end + 1
+        while pos < length:
+            if text[pos] != " ":
+                return False
+            pos += 1
+        return True
+
 
 class Matcher:
     spec: Any
+    casemapping: Optional[str] = None
 
     @abstractmethod
     def matches(self, target: str):
         pass
 
+    def matches_key(self, key: str):
+        """Like `matches`, for a target already folded with `self.casemapping`"""
+        return self.matches(key)
+
 
 class String(Matcher):
+    """Matches a target exactly, or by casemapping if one is given
+
+    Args:
+        spec (str): The string to compare against
+        casemapping (Optional[str]): One of CASEMAPPINGS; targets that fold to
+            the same name as `spec` match
+    """
+
     spec: str
 
-    def __init__(self, spec: str):
-        self.spec = spec
+    def __init__(self, spec: str, casemapping: Optional[str] = None):
+        self.casemapping = casemapping
+        self.spec = casefold(spec, casemapping) if casemapping else spec
 
     def matches(self, target: str):
+        if self.casemapping is not None:
+            target = casefold(target, self.casemapping)
         return target == self.spec
 
+    def matches_key(self, key: str):
+        return key == self.spec
+
 
 class RegExp(Matcher):
+    """Matches targets the pattern fully matches
+
+    With a casemapping, the target is folded before matching, so the pattern
+    should be written in folded (lowercase) form.
+    """
+
     spec: Pattern
 
-    def __init__(self, spec: str):
+    def __init__(self, spec: str, casemapping: Optional[str] = None):
+        self.casemapping = casemapping
         self.spec = re.compile(spec)
 
     def matches(self, target: str):
+        if self.casemapping is not None:
+            target = casefold(target, self.casemapping)
         return self.spec.fullmatch(target) is not None
 
+    def matches_key(self, key: str):
+        return self.spec.fullmatch(key) is not None
+
 
 class Glob(RegExp):
-    def __init__(self, spec: str):
-        super().__init__(re.escape(spec.replace("*", "\x00")).replace("\x00", ".*"))
+    def __init__(self, spec: str, casemapping: Optional[str] = None):
+        if casemapping:
+            spec = casefold(spec, casemapping)
+        super().__init__(
+            re.escape(spec.replace("*", "\x00")).replace("\x00", ".*"), casemapping
+        )
+
+
+class KeywordSet(Matcher):
+    """Matches targets containing any of a set of keywords
+
+    Builds an Aho-Corasick automaton, so a target is scanned once no matter how
+    many keywords there are.
+
+    Args:
+        keywords (Iterable[str]): Keywords or phrases to look for
+        ignore_case (bool): Compare keywords and targets lowercased one code
+            point at a time, so offsets into the target stay valid
+        whole_words (bool): Only count hits not surrounded by word characters
+    """
+
+    spec: List[str]
+
+    def __init__(
+        self,
+        keywords: Iterable[str],
+        ignore_case: bool = False,
+        whole_words: bool = False,
+    ):
+        self.ignore_case = ignore_case
+        self.whole_words = whole_words
+        if ignore_case:
+            keywords = (_fold_case(k) for k in keywords)
+        self.spec = list(dict.fromkeys(keywords))
+
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for idx, keyword in enumerate(self.spec):
+            state = 0
+            for char in keyword:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            if keyword:
+                out[state].append(idx)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+    def _scan(self, target: str) -> Iterator[Tuple[int, str]]:
+        # word boundaries are checked on the original text
+        folded = _fold_case(target) if self.ignore_case else target
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        spec = self.spec
+        state = 0
+        for pos, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for idx in out[state]:
+                keyword = spec[idx]
+                start = pos - len(keyword) + 1
+                if self.whole_words and (
+                    (start > 0 and _is_word(target[start - 1]))
+                    or (pos + 1 < len(target) and _is_word(target[pos + 1]))
+                ):
+                    continue
+                yield start, keyword
+
+    def search(self, target: str) -> List[Tuple[int, str]]:
+        """Return (offset, keyword) for every hit in `target`, in order of their end"""
+        return list(self._scan(target))
+
+    def matches(self, target: str):
+        return next(self._scan(target), None) is not None
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _fold_case(text: str) -> str:
+    """Lowercase `text` without changing its length
 
+    A code point whose lowercase form is longer, like "İ", is left as is.
+    """
+    if text.isascii():
+        return text.lower()
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
 
-def match_array(spec: List[Matcher], target: List[str]) -> bool:
+
+def match_array(spec: List[Optional[Matcher]], target: List[str]) -> bool:
     if len(spec) > len(target):
         return False
 
@@ -173,40 +503,28 @@ def match_array(spec: List[Matcher], target: List[str]) -> bool:
 MessageFilterLambda = Callable[[IrcMessage], bool]
 
 
-def match_message(command: str, params: List[Matcher]) -> MessageFilterLambda:
-    return lambda msg: msg.command == command and match_array(params, msg.params)
-
-
-# IrcResponseCallback = Callable[[bool, Union[None, List[List[str]]]], None]
+def match_keys(spec: List[Optional[Matcher]], msg: IrcMessage) -> bool:
+    """Like match_array, using the message's cached keys for casemapped matchers"""
+    params = msg.params
+    if len(spec) > len(params):
+        return False
 
+    for idx, item in enumerate(spec):
+        if item is None:
+            continue
+        if item.casemapping is None:
+            if not item.matches(params[idx]):
+                return False
+        elif not item.matches_key(msg.key(idx, item.casemapping)):
+            return False
 
-# class AsyncIrcResponse:
-#     callback: IrcResponseCallback
-#     capture: LambdaType[IrcMessage]
-#     error: LambdaType[IrcMessage]
-#     done: LambdaType[IrcMessage]
-#     results: List[List[str]]
+    return True
 
-#     def __init__(
-#         self,
-#         callback: IrcResponseCallback,
-#         error=LambdaType[IrcMessage],
-#         done=LambdaType[IrcMessage],
-#         capture=Optional[LambdaType[IrcMessage]],
-#     ):
-#         self.callback = callback
-#         self.capture = capture
-#         self.error = error
-#         self.done = done
-#         self.results = []
 
-#     def on_message(self, msg: IrcMessage):
-#         if self.error and self.error(msg):
-#             self.callback(True, None)
-#         elif self.capture and self.capture(msg):
-#             self.results.append(msg.params)
-#         elif self.done and self.done(msg):
-#             self.callback(False, self.results)
+def match_message(command: str, params: List[Optional[Matcher]]) -> MessageFilterLambda:
+    if any(p is not None and p.casemapping is not None for p in params):
+        return lambda msg: msg.command == command and match_keys(params, msg)
+    return lambda msg: msg.command == command and match_array(params, msg.params)
 
 
 class ReturnCode(Enum):
@@ -215,43 +533,382 @@ class ReturnCode(Enum):
     ERROR = w.WEECHAT_RC_ERROR
 
 
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class LoadShedder:
+    """Tracks the time spent in handlers and sheds work when over budget
+
+    Time is accounted in windows of `window_ms`. Once more than `budget_ms` has
+    been spent in the current window, each LOW priority per-line handler only
+    sees one line in `sample`, and batches below HIGH priority are deferred instead
+    of delivered. Handlers that can eat or rewrite lines at NORMAL or HIGH
+    priority always run.
+    """
+
+    def __init__(self, budget_ms: int = 20, window_ms: int = 100, sample: int = 10):
+        self.budget = budget_ms / 1000
+        self.window = window_ms / 1000
+        self.sample = sample
+        self.window_start = 0.0
+        self.spent = 0.0
+        self.seq: Dict[Any, int] = {}
+        self.overloaded_windows = 0
+        self.dropped: DefaultDict[str, int] = defaultdict(int)
+        self.deferred: DefaultDict[str, int] = defaultdict(int)
+
+    def overloaded(self) -> bool:
+        now = perf_counter()
+        if now - self.window_start >= self.window:
+            if self.spent > self.budget:
+                self.overloaded_windows += 1
+            self.window_start = now
+            self.spent = 0.0
+            return False
+        return self.spent > self.budget
+
+    def charge(self, start: float):
+        self.spent += perf_counter() - start
+
+    def admit(self, priority: Priority, handler: Any) -> bool:
+        """Decide whether a per-line handler runs while overloaded"""
+        if priority != Priority.LOW:
+            return True
+        # counted per handler, so handlers sharing a line are sampled alike
+        seq = self.seq[handler] = self.seq.get(handler, 0) + 1
+        if seq % self.sample == 0:
+            return True
+        self.dropped[_handler_name(handler)] += 1
+        return False
+
+    def reset(self):
+        self.overloaded_windows = 0
+        self.dropped.clear()
+        self.deferred.clear()
+
+
+def _handler_name(handler: Any) -> str:
+    return getattr(handler, "__qualname__", None) or handler.__class__.__name__
+
+
+load_shedder = LoadShedder()
+
+
+_capture: Optional[Deque[Tuple[Any, ...]]] = None
+_capture_dropped = 0
+
+
+def set_capture(buffer: Optional[Deque[Tuple[Any, ...]]]):
+    """Start appending every raw IRC line and hook_line table to `buffer`
+
+    Each entry is (timestamp, "irc", signal, line) or (timestamp, "line",
+    event callback name, hashtable). Once a bounded `buffer` is full, each
+    append discards its oldest entry, counted in `_capture_dropped` until the
+    next capture starts. Pass None to stop.
+    """
+    global _capture, _capture_dropped
+    if buffer is not None:
+        _capture_dropped = 0
+    _capture = buffer
+
+
+_metrics: Optional[Any] = None
+
+
+def set_metrics(metrics: Optional[Any]):
+    """Start counting incoming lines with an `api.metrics.Metrics`; None stops"""
+    global _metrics
+    _metrics = metrics
+
+
+class Batch:
+    """Queues items for a handler and delivers them as a list
+
+    A batch is delivered once it holds `size` items, or `interval` ms after its
+    first item was queued. All batches share a single timeout that is armed for
+    the earliest pending deadline. While `load_shedder` is overloaded, delivery
+    of batches below HIGH priority is pushed back by another interval, at most
+    `max_deferrals` times in a row, and at most `size * 10` items are kept.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[List[Any]], Any],
+        size: int,
+        interval: int,
+        priority: Priority = Priority.NORMAL,
+        name: str = "",
+        max_deferrals: int = 10,
+    ):
+        self.callback = callback
+        self.size = size
+        self.interval = interval
+        self.priority = priority
+        self.name = name or _handler_name(callback)
+        self.max_deferrals = max_deferrals
+        self.items: List[Any] = []
+        self.deadline = 0.0
+        self.queued = False
+        self.deferrals = 0
+
+    def push(self, item: Any):
+        self.items.append(item)
+        if len(self.items) >= self.size:
+            if self.deferrals:
+                # already waiting out an overload; the deadline delivers it
+                self._trim()
+            else:
+                self.flush()
+        elif len(self.items) == 1:
+            self.defer()
+
+    def defer(self):
+        self.deadline = monotonic() + self.interval / 1000
+        if not self.queued:
+            self.queued = True
+            _batches.append(self)
+        _schedule_batches(self.deadline)
+
+    def flush(self, force: bool = False):
+        if not self.items:
+            return
+
+        if (
+            not force
+            and self.priority != Priority.HIGH
+            and self.deferrals < self.max_deferrals
+            and load_shedder.overloaded()
+        ):
+            load_shedder.deferred[self.name] += 1
+            self.deferrals += 1
+            self._trim()
+            self.defer()
+            return
+
+        items = self.items
+        self.items = []
+        self.deferrals = 0
+        start = perf_counter()
+        self.callback(items)
+        load_shedder.charge(start)
+
+    def _trim(self):
+        excess = len(self.items) - self.size * 10
+        if excess > 0:
+            del self.items[:excess]
+            load_shedder.dropped[self.name] += excess
+
+
+_batches: List[Batch] = []
+_batch_timer: List[Any] = [None, 0.0]
+
+
+def _schedule_batches(deadline: float):
+    clear, armed = _batch_timer
+    if clear is not None:
+        if armed <= deadline:
+            return
+        clear()
+    delay = max(int((deadline - monotonic()) * 1000), 1)
+    _batch_timer[:] = [set_timeout(delay, _run_batches), deadline]
+
+
+def _run_batches(remaining_calls: int):
+    _batch_timer[:] = [None, 0.0]
+    now = monotonic()
+    due = [b for b in _batches if not b.items or b.deadline <= now]
+    _batches[:] = [b for b in _batches if b.items and b.deadline > now]
+    for batch in due:
+        batch.queued = False
+        batch.flush()
+    if _batches:
+        _schedule_batches(min(b.deadline for b in _batches))
+
+
+def flush_batches():
+    """Deliver every pending batch immediately"""
+    pending = _batches[:]
+    _batches.clear()
+    for batch in pending:
+        batch.queued = False
+        batch.flush(force=True)
+
+
+_shutdown_callbacks: List[Callable[[], Any]] = []
+
+
+def on_shutdown(callback: Callable[[], Any]):
+    """Call `callback` from `Script.shutdown`, before state is saved
+
+    For resources that must be released before WeeChat tears down the
+    script's interpreter, such as threads. Registering it again is a no-op.
+    """
+    if callback not in _shutdown_callbacks:
+        _shutdown_callbacks.append(callback)
+
+
 IrcCallback = Callable[[str, IrcMessage], ReturnCode]
-IrcCallbackTuple = Tuple[MessageFilterLambda, IrcCallback]
+IrcBatchCallback = Callable[[List[Tuple[str, IrcMessage]]], Any]
+IrcCallbackTuple = Tuple[MessageFilterLambda, IrcCallback, Optional[Batch], Priority]
+IrcModifier = Callable[[str, IrcMessage], Optional[IrcMessage]]
+IrcModifierRule = Tuple[MessageFilterLambda, IrcModifier]
+
+
+class TargetIndex:
+    """Decision table for the entries attached to a single IRC command
+
+    Entries whose first param is a plain `String` are indexed by that target,
+    folded with the index's casemapping; all others apply to every target. Each
+    index entry holds the complete, ordered list of entries for its target so a
+    lookup is a single dict access on the raw line, before it's parsed.
+    """
+
+    def __init__(self, casemapping: Optional[str] = None):
+        self.casemapping = casemapping
+        self.entries: List[Tuple[Optional[str], Any]] = []
+        self.by_target: Dict[str, List[Any]] = {}
+        self.any_target: List[Any] = []
+
+    def add(self, params: List[Optional[Matcher]], entry: Any):
+        first = params[0] if params else None
+        target = None
+        if type(first) is String and first.casemapping in (None, self.casemapping):
+            target = first.spec
+            if self.casemapping is not None:
+                target = casefold(target, self.casemapping)
+        self.entries.append((target, entry))
+        self.compile()
+
+    def compile(self):
+        self.any_target = [e for t, e in self.entries if t is None]
+        targets = {t for t, _ in self.entries if t is not None}
+        self.by_target = {
+            target: [e for t, e in self.entries if t is None or t == target]
+            for target in targets
+        }
 
+    def lookup(self, line: str) -> List[Any]:
+        if not self.by_target:
+            return self.any_target
+        target = _peek_target(line)
+        if self.casemapping is not None:
+            target = casefold(target, self.casemapping)
+        return self.by_target.get(target, self.any_target)
 
-callback_rexp = re.compile("(\S+)(\s*=\s*[^\s\.]callback\([^\)]+\).*)", re.DOTALL)
 
+def _peek_target(line: str) -> str:
+    """Extract the first param of a raw IRC line without parsing it"""
+    idx = 0
+    if line.startswith("@"):
+        idx = line.find(" ") + 1
+    if line.startswith(":", idx):
+        idx = line.find(" ", idx) + 1
+    idx = line.find(" ", idx) + 1
+    if idx == 0:
+        return ""
+    end = line.find(" ", idx)
+    target = line[idx:] if end == -1 else line[idx:end]
+    return target[1:] if target.startswith(":") else target
+
+
+def _wire_command(command: str) -> str:
+    """The command a (possibly CTCP_ or CTCPREPLY_) command arrives as"""
+    if command.startswith("CTCP_"):
+        return "PRIVMSG"
+    if command.startswith("CTCPREPLY_"):
+        return "NOTICE"
+    return command
 
-def assert_named_correctly(callback_name: str):
-    for frame in inspect.stack():
-        if frame.code_context and ".callback(" in frame.code_context[0]:
-            left, right = frame.code_context[0].strip(" \r\n").split("=")
-            left = left.strip()
-            right = right.strip()
-            if left == callback_name:
-                return
-            raise AssertionError(
-                f"Weechat requires callbacks to exist in global scope of the source script. Use `{callback_name} = {right}`"
-            )
-    w.prnt("", "could not identify callsite, can't verify callback is named correctly")
+
+def assert_named_correctly(callback_name: str, method: str = "callback"):
+    from api.debug import assert_named_correctly
+
+    assert_named_correctly(callback_name, method)
 
 
 class Irc:
+    """Dispatches incoming IRC lines to handlers registered with `on`
+
+    Args:
+        casemapping (Optional[str]): How the server compares nicks and channel
+            names, one of CASEMAPPINGS, e.g. "rfc1459", or "ascii" on Twitch.
+            Plain string targets given to `on` and `modify` then match any
+            case variant; None, the default, compares them exactly.
+    """
+
     Message: Type[IrcMessage]
     callbacks: DefaultDict[str, List[IrcCallbackTuple]]
+    dispatch: Dict[str, TargetIndex]
+    modifiers: Dict[str, TargetIndex]
 
-    def __init__(self):
+    def __init__(self, casemapping: Optional[str] = None):
         self.Message = IrcMessage
+        self.casemapping = casemapping
         self.callbacks = defaultdict(list)
+        self.dispatch = {}
+        self.modifiers = {}
+
+    def _matchers(
+        self, params: List[Union[None, str, Matcher]]
+    ) -> List[Optional[Matcher]]:
+        # only the target (a channel or nick) is casemapped, text stays exact
+        return [
+            (
+                p
+                if p is None or isinstance(p, Matcher)
+                else String(p, self.casemapping if idx == 0 else None)
+            )
+            for idx, p in enumerate(params)
+        ]
+
+    def _index(self, tables: Dict[str, TargetIndex], command: str) -> TargetIndex:
+        table = tables.get(command)
+        if table is None:
+            table = tables[command] = TargetIndex(self.casemapping)
+        return table
 
     def on(
         self,
-        callback: IrcCallback,
+        callback: Union[IrcCallback, IrcBatchCallback],
         command: str,
-        params: List[Union[str, Matcher]] = [],
+        params: List[Union[None, str, Matcher]] = [],
+        batch: int = 0,
+        batch_ms: int = 1000,
+        priority: Priority = Priority.NORMAL,
     ) -> None:
-        ps: List[Matcher] = [p if isinstance(p, Matcher) else String(p) for p in params]
-        self.callbacks[command].append((match_message(command, ps), callback))
+        """Call `callback` for incoming messages matching command and params
+
+        Args:
+            callback (IrcCallback): Called with (server, msg); returning anything
+                but ReturnCode.OK stops later handlers
+            command (str): IRC command to match, e.g. PRIVMSG
+            params (List[Union[str, Matcher]]): Matchers for the leading params;
+                a plain string target is compared using the casemapping
+            batch (int): If set, the callback is instead called with a list of
+                (server, msg) tuples once `batch` messages are queued or
+                `batch_ms` ms have passed; it can't eat or alter messages
+            batch_ms (int): Maximum time a message waits in the batch
+            priority (Priority): How readily the handler is shed under load
+        """
+        ps = self._matchers(params)
+        filter = match_message(command, ps)
+        queue = None
+        if batch > 0:
+            batch_callback = cast(IrcBatchCallback, callback)
+            queue = Batch(
+                lambda items: self._deliver(filter, batch_callback, items),
+                batch,
+                batch_ms,
+                priority,
+                _handler_name(callback),
+            )
+        # an entry with a queue only ever has its items pushed to the queue
+        entry = (filter, cast(IrcCallback, callback), queue, priority)
+        self.callbacks[command].append(entry)
+        self._index(self.dispatch, _wire_command(command)).add(ps, entry)
 
     def callback(self, callback_name: str) -> Callable[[str, str, str], int]:
         ret = lambda *args: self._callback(*args).value
@@ -261,32 +918,326 @@ class Irc:
         return ret
 
     def _callback(self, data: str, signal: str, payload: str) -> ReturnCode:
+        global _capture_dropped
+        if _capture is not None:
+            if len(_capture) == _capture.maxlen:
+                _capture_dropped += 1
+            _capture.append((time(), "irc", signal, payload))
+
         server, command = signal.split(",")
         command = command[11:]
 
-        if len(self.callbacks[command]) == 0:
+        if _metrics is not None:
+            _metrics.irc(server, command, payload)
+
+        table = self.dispatch.get(command)
+        if table is None:
+            return ReturnCode.OK
+        callbacks = table.lookup(payload)
+        if not callbacks:
+            return ReturnCode.OK
+
+        start = perf_counter()
+        overloaded = load_shedder.overloaded()
+        msg: Optional[IrcMessage] = None
+        try:
+            for filter, callback, queue, priority in callbacks:
+                if queue is not None:
+                    queue.push((server, payload, msg))
+                    continue
+
+                if overloaded and not load_shedder.admit(priority, callback):
+                    continue
+
+                if msg is None:
+                    msg = self.Message(server, payload)
+                if not filter(msg):
+                    continue
+
+                r = callback(server, msg)
+
+                if not r == ReturnCode.OK:
+                    return r
+
             return ReturnCode.OK
+        finally:
+            load_shedder.charge(start)
+
+    def _deliver(
+        self,
+        filter: MessageFilterLambda,
+        callback: IrcBatchCallback,
+        items: List[Tuple[str, str, Optional[IrcMessage]]],
+    ):
+        batch = []
+        for server, payload, msg in items:
+            if msg is None:
+                msg = self.Message(server, payload)
+            if filter(msg):
+                batch.append((server, msg))
+        if batch:
+            callback(batch)
+
+    def modify(
+        self,
+        callback: IrcModifier,
+        command: str,
+        params: List[Union[None, str, Matcher]] = [],
+    ) -> None:
+        """Rewrite or drop incoming lines before WeeChat processes them
+
+        The callback receives the parsed message and returns it (mutated or not)
+        to keep the line, or None to drop it. Rules run in registration order.
+
+        Args:
+            callback (IrcModifier): Function to call for matching lines
+            command (str): IRC command to match, e.g. PRIVMSG
+            params (List[Union[str, Matcher]]): Matchers for the leading params;
+                a plain string target is compared using the casemapping
+        """
+        ps = self._matchers(params)
+        command = command.upper()
+        rule = (match_message(command, ps), callback)
+        self._index(self.modifiers, _wire_command(command)).add(ps, rule)
+
+    def modifier(self, callback_name: str) -> Callable[[str, str, str, str], str]:
+        """Hook the modifiers for every command passed to `modify`
 
-        r: ReturnCode = ReturnCode.OK
-        msg = self.Message(server, payload)
-        for filter, callback in self.callbacks[command]:
+        Must be called after the rules are registered, and the returned function
+        stored in the script's global scope under `callback_name`.
+        """
+        assert_named_correctly(callback_name, "modifier")
+
+        for command in self.modifiers:
+            w.hook_modifier(f"irc_in2_{command.lower()}", callback_name, "")
+        return self._modify
+
+    def _modify(self, data: str, modifier: str, server: str, line: str) -> str:
+        table = self.modifiers.get(modifier[8:].upper())
+        if table is None:
+            return line
+
+        rules = table.lookup(line)
+        if not rules:
+            return line
+
+        msg: Optional[IrcMessage] = self.Message(server, line)
+        for filter, callback in rules:
             if not filter(msg):
                 continue
 
-            r = callback(server, msg)
-
-            if not r == ReturnCode.OK:
-                return r
+            msg = callback(server, msg)
+            if msg is None:
+                return ""
 
-        return ReturnCode.OK
+        return str(msg)
 
 
 class TwitchIrc(Irc):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, casemapping: Optional[str] = None):
+        super().__init__(casemapping)
         self.Message = TwitchMessage
 
 
+IrcQueryResult = Tuple[Tuple[str, ...], ...]
+IrcResponseCallback = Callable[[bool, Optional[IrcQueryResult]], None]
+IrcQueryKey = Tuple[str, str, str]
+
+
+class IrcQuery:
+    """The numerics answering one kind of query, mapped to their target params
+
+    Replies are matched to a pending query by (server, numeric, target), where
+    the target is the param at one of the mapped indexes: the channel or nick
+    queried. A WHO reply, for instance, names the channel at 1 and the nick
+    at 5, and either can be what was queried.
+    """
+
+    def __init__(
+        self,
+        capture: Dict[str, Tuple[int, ...]],
+        done: Dict[str, Tuple[int, ...]],
+        error: Dict[str, Tuple[int, ...]] = {},
+    ):
+        self.capture = capture
+        self.done = done
+        self.error = error
+
+
+IRC_QUERIES: Dict[str, IrcQuery] = {
+    "WHO": IrcQuery(capture={"352": (1, 5)}, done={"315": (1,)}, error={"403": (1,)}),
+    "NAMES": IrcQuery(capture={"353": (2,)}, done={"366": (1,)}),
+    "WHOIS": IrcQuery(
+        capture={
+            n: (1,)
+            for n in ("301", "307", "311", "312", "313", "317", "319", "330", "671")
+        },
+        done={"318": (1,)},
+        error={"401": (1,), "402": (1,)},
+    ),
+}
+
+
+class AsyncIrcResponse:
+    """One in-flight query, and every caller waiting for its result"""
+
+    __slots__ = ("key", "callbacks", "results", "routes", "cancel_timeout")
+
+    def __init__(self, key: IrcQueryKey, callback: IrcResponseCallback):
+        self.key = key
+        self.callbacks = [callback]
+        self.results: List[Tuple[str, ...]] = []
+        self.routes: List[IrcQueryKey] = []
+        self.cancel_timeout: Optional[Callable] = None
+
+
+class IrcRequests:
+    """Sends WHO/NAMES/WHOIS-style queries and routes their numeric replies
+
+    Pending queries are indexed by (server, numeric, target), so routing a
+    reply is one dict lookup no matter how many queries are in flight. An
+    identical query that is already in flight gets the caller added to its
+    waiters instead of being sent again, and results are cached for `ttl`
+    seconds. Callbacks get (failed, results) with the params of every
+    captured reply, as tuples since they're shared between callers; failed is
+    True on an error numeric or after `timeout` ms without an answer. Timeouts
+    use `set_timeout`, so `timer_callback` must be in the script's global
+    scope.
+
+    Args:
+        irc (Irc): Dispatcher whose handlers receive the replies
+        ttl (float): Seconds a result is served from the cache
+        timeout (int): Milliseconds to wait for the end of a reply
+        max_cached (int): Results kept in the cache
+        quiet (bool): Eat the replies to our own queries, so WeeChat doesn't
+            print them; handlers registered after this one won't see them
+    """
+
+    def __init__(
+        self,
+        irc: Irc,
+        ttl: float = 60.0,
+        timeout: int = 10000,
+        max_cached: int = 256,
+        quiet: bool = False,
+    ):
+        self.irc = irc
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_cached = max_cached
+        self.quiet = quiet
+        self.inflight: Dict[IrcQueryKey, AsyncIrcResponse] = {}
+        self.routes: Dict[IrcQueryKey, Tuple[AsyncIrcResponse, str]] = {}
+        self.cache: "OrderedDict[IrcQueryKey, Tuple[float, IrcQueryResult]]" = (
+            OrderedDict()
+        )
+
+        # numeric -> the param indexes its target can be at
+        self.numerics: Dict[str, Set[int]] = defaultdict(set)
+        for query in IRC_QUERIES.values():
+            for numerics in (query.capture, query.done, query.error):
+                for numeric, indexes in numerics.items():
+                    self.numerics[numeric].update(indexes)
+        for numeric in sorted(self.numerics):
+            irc.on(self.on_reply, numeric, priority=Priority.HIGH)
+
+    def _fold(self, target: str) -> str:
+        cm = self.irc.casemapping
+        return casefold(target, cm) if cm else target
+
+    def request(
+        self, server: str, kind: str, target: str, callback: IrcResponseCallback
+    ):
+        """Query `target` (a channel or nick) on `server` with `kind`, e.g. WHO"""
+        query = IRC_QUERIES[kind.upper()]
+        key = (server, kind.upper(), self._fold(target))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            if cached[0] > monotonic():
+                self.cache.move_to_end(key)
+                callback(False, cached[1])
+                return
+            del self.cache[key]
+
+        pending = self.inflight.get(key)
+        if pending is not None:
+            pending.callbacks.append(callback)
+            return
+
+        pending = self.inflight[key] = AsyncIrcResponse(key, callback)
+        for kind_of, numerics in (
+            ("capture", query.capture),
+            ("done", query.done),
+            ("error", query.error),
+        ):
+            for numeric in numerics:
+                route = (server, numeric, key[2])
+                self.routes[route] = (pending, kind_of)
+                pending.routes.append(route)
+        pending.cancel_timeout = set_timeout(
+            self.timeout, lambda remaining: self._finish(pending, True)
+        )
+        w.command("", "/quote -server {} {} {}".format(server, key[1], target))
+
+    def invalidate(self, server: str, kind: Optional[str] = None, target: str = ""):
+        """Drop cached results for `server`, optionally only one kind or target"""
+        folded = self._fold(target) if target else ""
+        for key in list(self.cache):
+            if key[0] == server and (kind is None or key[1] == kind.upper()):
+                if not folded or key[2] == folded:
+                    del self.cache[key]
+
+    def on_reply(self, server: str, msg: IrcMessage) -> ReturnCode:
+        if not self.routes:
+            return ReturnCode.OK
+
+        command = msg.command
+        casemapping = self.irc.casemapping
+        # a reply can answer more than one query, e.g. a WHO reply both for
+        # the channel and for the nick
+        matched: List[AsyncIrcResponse] = []
+        for idx in self.numerics.get(command, ()):
+            if idx >= len(msg.params):
+                continue
+
+            target = msg.key(idx, casemapping) if casemapping else msg.params[idx]
+            route = self.routes.get((server, command, target))
+            if route is None or route[0] in matched:
+                continue
+
+            pending, kind_of = route
+            matched.append(pending)
+            if kind_of == "capture":
+                pending.results.append(tuple(msg.params))
+            else:
+                self._finish(pending, kind_of == "error")
+
+        if matched and self.quiet:
+            return ReturnCode.OK_EAT
+        return ReturnCode.OK
+
+    def _finish(self, pending: AsyncIrcResponse, failed: bool):
+        if self.inflight.get(pending.key) is not pending:
+            return
+        del self.inflight[pending.key]
+        for route in pending.routes:
+            if self.routes.get(route, (None,))[0] is pending:
+                del self.routes[route]
+        if pending.cancel_timeout is not None:
+            pending.cancel_timeout()
+
+        results = None if failed else tuple(pending.results)
+        if results is not None:
+            self.cache[pending.key] = (monotonic() + self.ttl, results)
+            self.cache.move_to_end(pending.key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+        for callback in pending.callbacks:
+            callback(failed, results)
+
+
 # def irc_raw_in_cb(data, signal, payload):
 #     if data == "synthetic":
 #         return ReturnCode.OK
@@ -404,15 +1355,15 @@ class Message:
         return w.string_remove_color(self.message, "")
 
     def __setattr__(self, name: str, value: Union[datetime, Set[str], int, str]):
-        data = object.__getattribute__(self, "data")
         if hasattr(self, name) and not name.startswith("_"):
-            if type(data[name]) != type(value):
+            current = object.__getattribute__(self, name)
+            if type(current) != type(value):
                 raise TypeError(
                     "Invalid type: Provided: {}; '{}.{}': {}".format(
                         type(value),
                         object.__getattribute__(self, "__class__").__name__,
                         name,
-                        type(data[name]),
+                        type(current),
                     )
                 )
             object.__setattr__(self, name, value)
@@ -424,17 +1375,22 @@ class Message:
                 )
             )
 
-    def _diff(self):
+    def delete(self):
+        """Remove the line from its buffer instead of displaying it"""
+        self.buffer_name = ""
+
+    def _diff(self) -> Dict[str, str]:
         res = {}
         for k in self.modified:
-            if isinstance(k, str):
-                res[k] = self.__dict__[k]
-            elif isinstance(k, int):
-                res[k] = str(self.__dict__[k])
-            elif isinstance(k, datetime):
-                res[k] = str(int(self.__dict__[k].timestamp()))
-            elif isinstance(k, set):
-                res[k] = ",".join(self.__dict__[k])
+            v = self.__dict__[k]
+            key = "buffer" if k == "ptr" else k
+            if isinstance(v, datetime):
+                res[key] = str(int(v.timestamp()))
+            elif isinstance(v, set):
+                res[key] = ",".join(v)
+            else:
+                res[key] = str(v)
+        return res
 
 
 class FormattedMessage(Message):
@@ -455,17 +1411,168 @@ def get_message(htable: dict):
         raise TypeError("htable is not a known buffer type")
 
 
+# notify levels that always come from a tag; level 0 (low) is the absence of one
+_NOTIFY_TAGS = {
+    -1: MessageTag.NOTIFY_NONE,
+    1: MessageTag.NOTIFY_MESSAGE,
+    2: MessageTag.NOTIFY_PRIVATE,
+    3: MessageTag.NOTIFY_HIGHLIGHT,
+}
+_MAX_TAG_COMBINATIONS = 64
+
+
+class LineFilter:
+    """Declarative description of the lines an Event wants
+
+    `hook_args` compiles it into the most selective hook_line arguments, so
+    WeeChat discards most other lines in C. Whatever can't be expressed there
+    is checked by `matches` on the raw line table, before a Message is built.
+    Every criterion that is set must hold; within one, any value may match.
+
+    Args:
+        buffers (Iterable[str]): Buffer full name masks, `*` wildcards allowed
+        buffer_type (str): "formatted", "free" or "*" for both
+        commands (Iterable[str]): IRC commands, matched via their irc_* tags
+        tags (Iterable[str]): Tags that must all be present
+        exclude_tags (Iterable[str]): Tags that must all be absent
+        notify_levels (Iterable[int]): Accepted notify levels, -1 to 3
+        nicks (Iterable[str]): Accepted senders, matched via their nick_* tags
+        first_words (Iterable[str]): Accepted first words of the message text
+    """
+
+    def __init__(
+        self,
+        buffers: Iterable[str] = (),
+        buffer_type: str = "formatted",
+        commands: Iterable[str] = (),
+        tags: Iterable[str] = (),
+        exclude_tags: Iterable[str] = (),
+        notify_levels: Iterable[int] = (),
+        nicks: Iterable[str] = (),
+        first_words: Iterable[str] = (),
+    ):
+        self.buffers = tuple(buffers)
+        self.buffer_type = buffer_type
+        self.tags = tuple(tags)
+        self.exclude_tags = tuple(exclude_tags)
+        self.notify_levels = frozenset(notify_levels)
+        self.first_words = frozenset(first_words)
+        self.any_of: List[Tuple[str, ...]] = [
+            group
+            for group in (
+                tuple(MessageTag.IRC(c) for c in commands),
+                tuple(MessageTag.NICK(n) for n in nicks),
+            )
+            if group
+        ]
+
+        # tags that survive in the hook are enforced by WeeChat; the rest of
+        # the line's tags are checked in Python
+        self.hooked_tags = ""
+        self.residual_any: List[Tuple[str, ...]] = []
+        self.residual_tags = self.tags
+        self.residual_exclude = self.exclude_tags
+        self._compile_tags()
+
+    def _compile_tags(self):
+        def plain(tag: str) -> bool:
+            return tag != "" and not any(c in tag for c in ",+!")
+
+        required = [t for t in self.tags if plain(t)]
+        excluded = ["!" + t for t in self.exclude_tags if plain(t)]
+        groups = [g for g in self.any_of if all(plain(t) for t in g)]
+        notify = [_NOTIFY_TAGS.get(level) for level in self.notify_levels]
+        if notify and all(notify):
+            groups.append(tuple(notify))
+
+        # OR between comma-separated entries, AND within one: expand the
+        # groups into every combination, giving up on the largest ones first
+        groups.sort(key=len)
+        while groups and _product_size(groups) > _MAX_TAG_COMBINATIONS:
+            groups.pop()
+
+        combinations: List[List[str]] = [required + excluded]
+        for group in groups:
+            combinations = [c + [t] for c in combinations for t in group]
+        self.hooked_tags = ",".join("+".join(c) for c in combinations if c)
+
+        self.residual_tags = tuple(t for t in self.tags if not plain(t))
+        self.residual_exclude = tuple(t for t in self.exclude_tags if not plain(t))
+        self.residual_any = [g for g in self.any_of if g not in groups]
+
+    def hook_args(self) -> Tuple[str, str, str]:
+        """(buffer_type, buffer_name, tags) for hook_line"""
+        return self.buffer_type, ",".join(self.buffers), self.hooked_tags
+
+    def matches(self, line: dict) -> bool:
+        """Check the criteria hook_line couldn't on a raw line table"""
+        if self.notify_levels and int(line["notify_level"]) not in self.notify_levels:
+            return False
+
+        if self.residual_any or self.residual_tags or self.residual_exclude:
+            tags = set(line["tags"].split(","))
+            if any(t not in tags for t in self.residual_tags):
+                return False
+            if any(t in tags for t in self.residual_exclude):
+                return False
+            if any(tags.isdisjoint(group) for group in self.residual_any):
+                return False
+
+        if self.first_words:
+            text = w.string_remove_color(line["message"], "")
+            if text.split(" ", 1)[0] not in self.first_words:
+                return False
+
+        return True
+
+
+def _product_size(groups: List[Tuple[str, ...]]) -> int:
+    size = 1
+    for group in groups:
+        size *= len(group)
+    return size
+
+
 class Event:
     def __init__(
         self,
         buffer_type: str,
         buffer_name: str,
         match_tags: str,
+        filter: Optional[LineFilter] = None,
+        prefilter: Optional[Matcher] = None,
     ):
-        self.ptr = None
+        """Hook buffer lines, as hook_line, and pass each to `callback`
+
+        Args:
+            buffer_type (str): hook_line buffer type, ignored with `filter`
+            buffer_name (str): hook_line buffer masks, ignored with `filter`
+            match_tags (str): hook_line tags, ignored with `filter`
+            filter (Optional[LineFilter]): Lines to hook, see `set_filter`
+            prefilter (Optional[Matcher]): Matched against the uncolored
+                message text before a Message is built; lines it rejects are
+                skipped. Can also be set later through the `prefilter`
+                attribute
+        """
+        self.ptr: Optional[str] = None
+        self.batch: Optional[Batch] = None
+        self.priority = Priority.NORMAL
+        self.prefilter = prefilter
+        self.line_filter: Optional[LineFilter] = None
+        self.hooked_spec: Tuple[str, ...] = ()
+        self.callback_name = self.__class__.__name__.lower() + "_cb"
         self.buffer_type = buffer_type
         self.buffer_name = buffer_name
         self.match_tags = match_tags
+        if filter is not None:
+            self.set_filter(filter)
+
+    def set_filter(self, filter: LineFilter):
+        """Hook only the lines `filter` describes, rehooking if already installed"""
+        self.line_filter = filter
+        self.buffer_type, self.buffer_name, self.match_tags = filter.hook_args()
+        if self.ptr is not None and self.spec() != self.hooked_spec:
+            self.rehook()
 
     def hook(self):
         """Install the hook for an event
@@ -475,21 +1582,16 @@ class Event:
         """
         assert self.ptr is None, "Event hook already installed"
 
-        callback_name = self.__class__.__name__.lower() + "_cb"
-        try:
-            modname = next(
-                inspect.getmodule(x[0]).__name__
-                for x in inspect.stack()
-                if x[1] != __file__
-            )
-            exec("from {} import {}".format(modname, callback_name))
-            assert eval(callback_name) == self._callback
-        except (AssertionError, ImportError) as e:
-            raise AssertionError(
-                "Weechat requires callbacks to exist in global scope of the source script. Use `{} = script.register_event({}(...))`".format(
-                    callback_name, self.__class__.__name__
-                )
-            )
+        callback_name = self.callback_name
+        from api.debug import assert_global
+
+        assert_global(
+            callback_name,
+            self._callback,
+            "{} = script.register_event({}(...))".format(
+                callback_name, self.__class__.__name__
+            ),
+        )
 
         ptr = w.hook_line(
             self.buffer_type, self.buffer_name, self.match_tags, callback_name, ""
@@ -497,6 +1599,11 @@ class Event:
         assert ptr is not None, "weechat.hook_command failed"
 
         self.ptr = ptr
+        self.hooked_spec = self.spec()
+
+    def spec(self) -> Tuple[str, ...]:
+        """The hook_line arguments this event currently wants"""
+        return (self.buffer_type, self.buffer_name, self.match_tags)
 
     def unhook(self):
         """Removes the hook for this command"""
@@ -504,10 +1611,85 @@ class Event:
         w.unhook(self.ptr)
         self.ptr = None
 
+    def rehook(self):
+        """Replace an installed hook after buffer_type, buffer_name or match_tags change
+
+        The callback was verified when the hook was first installed, so this is
+        safe to call from within other callbacks.
+        """
+        assert self.ptr is not None, "Event hook not installed"
+        w.unhook(self.ptr)
+        self.ptr = w.hook_line(
+            self.buffer_type, self.buffer_name, self.match_tags, self.callback_name, ""
+        )
+        self.hooked_spec = self.spec()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return JSON-serializable state to carry over a script reload"""
+        return {}
+
+    def restore(self, state: Dict[str, Any]):
+        """Apply state returned by `snapshot` before the hook is installed"""
+        pass
+
+    def set_batch(self, size: int, interval: int):
+        """Deliver lines through `callback_batch` in batches instead of one by one
+
+        Batched lines can't be modified, so only use this for events that just
+        observe.
+
+        Args:
+            size (int): Deliver once this many lines are queued
+            interval (int): Deliver at most this many ms after the first queued line
+        """
+        self.batch = Batch(
+            lambda lines: self.callback_batch([get_message(l) for l in lines]),
+            size,
+            interval,
+            self.priority,
+            self.__class__.__name__,
+        )
+
     def _callback(self, data: str, line: dict) -> dict:
-        msg = get_message(line)
-        self.callback(msg)
-        return msg._diff()
+        global _capture_dropped
+        if _capture is not None:
+            if len(_capture) == _capture.maxlen:
+                _capture_dropped += 1
+            _capture.append((time(), "line", self.callback_name, line))
+        if _metrics is not None:
+            _metrics.line(line["buffer_name"])
+
+        if self.line_filter is not None and not self.line_filter.matches(line):
+            return {}
+
+        if self.prefilter is not None and not self.prefilter.matches(
+            w.string_remove_color(line["message"], "")
+        ):
+            return {}
+
+        if self.batch is not None:
+            self.batch.push(line)
+            return {}
+
+        start = perf_counter()
+        if load_shedder.overloaded() and not load_shedder.admit(self.priority, self):
+            return {}
+
+        try:
+            msg = get_message(line)
+            self.callback(msg)
+            return msg._diff()
+        finally:
+            load_shedder.charge(start)
+
+    def callback_batch(self, msgs: List[Message]):
+        """The method called with queued lines when batching is enabled
+
+        Defaults to calling `callback` for each line; changes to the lines are
+        discarded since they have already been displayed.
+        """
+        for msg in msgs:
+            self.callback(msg)
 
     def callback(self, msg: Message) -> dict:
         """The method called when the event is matched
@@ -525,6 +1707,118 @@ class Event:
         raise NotImplementedError("callback method not implemented")
 
 
+ChatCommandHandler = Callable[[Message, str], Any]
+
+
+class ChatCommand:
+    """A chat command's handler and cooldown, shared by all of its trie nodes"""
+
+    __slots__ = ("name", "handler", "cooldown", "next_allowed")
+
+    def __init__(self, name: str, handler: ChatCommandHandler, cooldown: float):
+        self.name = name
+        self.handler = handler
+        self.cooldown = cooldown
+        self.next_allowed = 0.0
+
+
+class TrieNode:
+    __slots__ = ("children", "command")
+
+    def __init__(self):
+        self.children: Dict[str, TrieNode] = {}
+        self.command: Optional[ChatCommand] = None
+
+
+class ChatCommandRouter(Event):
+    """Dispatches bot-style chat commands (!cmd args) from buffer lines
+
+    Every prefix + name + alias combination is stored in a trie. Only the first
+    word of a line is walked, one character at a time, and the walk stops at the
+    first character that no command continues with, so unrelated lines cost a
+    dict lookup or two.
+
+    Args:
+        buffer_name (str): Buffer mask(s) to watch, as for hook_line
+        prefixes (str): Characters that introduce a command
+        ignore_case (bool): Match command names case-insensitively
+    """
+
+    def __init__(self, buffer_name: str, prefixes: str = "!", ignore_case: bool = True):
+        self.root = TrieNode()
+        self.prefixes = prefixes
+        self.ignore_case = ignore_case
+        self.commands: Dict[str, ChatCommand] = {}
+        # our own lines are left out, or a handler that posts a command would
+        # trigger itself
+        super().__init__(
+            "",
+            "",
+            "",
+            LineFilter(
+                buffers=buffer_name.split(","),
+                commands=["privmsg"],
+                exclude_tags=[MessageTag.SELF_MSG],
+            ),
+        )
+
+    def command(
+        self,
+        name: str,
+        handler: ChatCommandHandler,
+        aliases: List[str] = [],
+        cooldown: float = 0,
+    ) -> ChatCommand:
+        """Route `<prefix><name> args` lines to `handler(msg, args)`
+
+        Args:
+            name (str): Command name, without prefix
+            handler (ChatCommandHandler): Called with the message and the text
+                after the command word
+            aliases (List[str]): Other names for the same command
+            cooldown (float): Seconds to ignore the command after it runs
+        """
+        command = ChatCommand(name, handler, cooldown)
+        self.commands[name] = command
+        for word in [name, *aliases]:
+            if self.ignore_case:
+                word = word.lower()
+            for prefix in self.prefixes:
+                node = self.root
+                for char in prefix + word:
+                    node = node.children.setdefault(char, TrieNode())
+                node.command = command
+        return command
+
+    def lookup(self, text: str) -> Tuple[Optional[ChatCommand], str]:
+        """Return the command that `text` invokes, if any, and its arguments"""
+        node = self.root
+        ignore_case = self.ignore_case
+        end = len(text)
+        for idx, char in enumerate(text):
+            if char == " ":
+                end = idx
+                break
+            child = node.children.get(char.lower() if ignore_case else char)
+            if child is None:
+                return None, ""
+            node = child
+        return node.command, text[end + 1 :]
+
+    def callback(self, msg: Message):
+        command, args = self.lookup(msg.message2)
+        if command is None:
+            return
+
+        if command.cooldown:
+            now = monotonic()
+            if now < command.next_allowed:
+                return
+            command.next_allowed = now + command.cooldown
+
+        command.handler(msg, args)
+
+
 class Command:
     def __init__(
         self,
@@ -543,7 +1837,8 @@ class Command:
             args_desc (str): Command argument detailed description, printed in /help <name>
             completion_template (str): Completion template for tab-completing arguments
         """
-        self.ptr = None
+        self.ptr: Optional[str] = None
+        self.hooked_spec: Tuple[str, ...] = ()
         self.name = name
         self.desc = desc
         self.args_syntax = args_syntax
@@ -559,20 +1854,15 @@ class Command:
         assert self.ptr is None, "Command hook already installed"
 
         callback_name = self.name.lower() + "_cb"
-        try:
-            modname = next(
-                inspect.getmodule(x[0]).__name__
-                for x in inspect.stack()
-                if x[1] != __file__
-            )
-            exec("from {} import {}".format(modname, callback_name))
-            assert eval(callback_name) == self.callback
-        except (AssertionError, ImportError) as e:
-            raise AssertionError(
-                "Weechat requires callbacks to exist in global scope of the source script. Use `{} = script.register_command({}(...))`".format(
-                    callback_name, self.__class__.__name__
-                )
-            )
+        from api.debug import assert_global
+
+        assert_global(
+            callback_name,
+            self.callback,
+            "{} = script.register_command({}(...))".format(
+                callback_name, self.__class__.__name__
+            ),
+        )
 
         ptr = w.hook_command(
             self.name,
@@ -586,6 +1876,25 @@ class Command:
         assert ptr is not None, "weechat.hook_command failed"
 
         self.ptr = ptr
+        self.hooked_spec = self.spec()
+
+    def spec(self) -> Tuple[str, ...]:
+        """The hook_command arguments this command currently wants"""
+        return (
+            self.name,
+            self.desc,
+            self.args_syntax,
+            self.args_desc,
+            self.completion_template,
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return JSON-serializable state to carry over a script reload"""
+        return {}
+
+    def restore(self, state: Dict[str, Any]):
+        """Apply state returned by `snapshot` before the hook is installed"""
+        pass
 
     def unhook(self):
         """Removes the hook for this command"""
@@ -610,6 +1919,157 @@ class Command:
         raise NotImplementedError("callback method not implemented")
 
 
+class ApiStats(Command):
+    def __init__(self, name: str = "apistats"):
+        """Reports load shedding counters: /apistats [reset]"""
+        super().__init__(
+            name,
+            "show handler load shedding statistics",
+            "[reset]",
+            "reset: clear the counters after printing them",
+            "reset",
+        )
+
+    def callback(self, data: str, buffer: str, args: str) -> int:
+        ls = load_shedder
+        w.prnt(
+            buffer,
+            "budget: {:.0f}ms per {:.0f}ms, spent {:.1f}ms, overloaded windows: {}".format(
+                ls.budget * 1000,
+                ls.window * 1000,
+                ls.spent * 1000,
+                ls.overloaded_windows,
+            ),
+        )
+        w.prnt(
+            buffer,
+            "pending batches: {} ({} items)".format(
+                len(_batches), sum(len(b.items) for b in _batches)
+            ),
+        )
+        for name in sorted(set(ls.dropped) | set(ls.deferred)):
+            w.prnt(
+                buffer,
+                "  {}: dropped {}, deferred {}".format(
+                    name, ls.dropped[name], ls.deferred[name]
+                ),
+            )
+
+        if args.strip() == "reset":
+            ls.reset()
+        return ReturnCode.OK.value
+
+
+ConfigValue = Union[str, int, bool, List[str]]
+ConfigListener = Callable[[str, ConfigValue], None]
+
+
+class Config:
+    def __init__(self, **options: Tuple[ConfigValue, str]):
+        """Script options, stored by WeeChat under plugins.var.python.<script>.*
+
+        The type of each option is taken from its default: str, int, bool
+        (on/off) or List[str] (comma-separated).
+
+        Args:
+            options (Tuple[ConfigValue, str]): Option name to (default, description)
+        """
+        self.ptr: Optional[str] = None
+        self.prefix = ""
+        self.options = options
+        self.values: Dict[str, ConfigValue] = {k: v[0] for k, v in options.items()}
+        self.listeners: List[ConfigListener] = []
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    def watch(self, listener: ConfigListener):
+        """Call `listener(name, value)` whenever an option changes value"""
+        self.listeners.append(listener)
+
+    def hook(self, script_name: str):
+        """Load option values from WeeChat and watch them for changes
+
+        Options that aren't set yet are created with their defaults.
+
+        Raises:
+            AssertionError: Raises if hook() is called in error or the callback variable is not set up correctly
+        """
+        assert self.ptr is None, "Config hook already installed"
+
+        callback_name = self.__class__.__name__.lower() + "_cb"
+        from api.debug import assert_global
+
+        assert_global(
+            callback_name,
+            self._callback,
+            "{} = script.register_config({}(...))".format(
+                callback_name, self.__class__.__name__
+            ),
+        )
+
+        for name, (default, desc) in self.options.items():
+            if not w.config_is_set_plugin(name):
+                w.config_set_plugin(name, self._serialize(default))
+            w.config_set_desc_plugin(name, desc)
+            self._update(name, w.config_get_plugin(name))
+
+        self.prefix = f"plugins.var.python.{script_name}."
+        ptr = w.hook_config(self.prefix + "*", callback_name, "")
+        assert ptr is not None, "weechat.hook_config failed"
+
+        self.ptr = ptr
+
+    def unhook(self):
+        """Stop watching the options for changes"""
+        assert self.ptr is not None
+        w.unhook(self.ptr)
+        self.ptr = None
+
+    def _callback(self, data: str, option: str, value: str) -> int:
+        self._update(option[len(self.prefix) :], value)
+        return ReturnCode.OK.value
+
+    def _update(self, name: str, raw: str):
+        if name not in self.options:
+            return
+
+        try:
+            value = self._parse(self.options[name][0], raw)
+        except ValueError:
+            w.prnt("", "Invalid value for option {}: {}".format(name, raw))
+            return
+
+        if value == self.values[name]:
+            return
+
+        self.values[name] = value
+        for listener in self.listeners:
+            listener(name, value)
+
+    @staticmethod
+    def _parse(default: ConfigValue, raw: str) -> ConfigValue:
+        if isinstance(default, bool):
+            if raw.lower() in ("on", "true", "yes", "1"):
+                return True
+            if raw.lower() in ("off", "false", "no", "0"):
+                return False
+            raise ValueError(raw)
+        if isinstance(default, int):
+            return int(raw)
+        if isinstance(default, list):
+            return [v.strip() for v in raw.split(",") if v.strip()]
+        return raw
+
+    @staticmethod
+    def _serialize(value: ConfigValue) -> str:
+        if isinstance(value, bool):
+            return "on" if value else "off"
+        if isinstance(value, list):
+            return ",".join(value)
+        return str(value)
+
+
 class Script:
     def __init__(
         self,
@@ -632,7 +2092,8 @@ class Script:
         self.command_hooks: List[Command] = []
         self.events: List[Event] = []
         self.event_hooks: List[Event] = []
-        self.ptr = None
+        self.configs: List[Config] = []
+        self.ptr: Optional[str] = None
         self.name = name
         self.author = author
         self.version = version
@@ -649,22 +2110,17 @@ class Script:
             str: pointer to the script's handle
         """
         shutdown_name = self.name.lower() + "_shutdown"
-        try:
-            modname = next(
-                inspect.getmodule(x[0]).__name__
-                for x in inspect.stack()
-                if x[1] != __file__
-            )
-            exec("from {} import {}".format(modname, shutdown_name))
-            assert eval(shutdown_name) == self.shutdown
-        except (AssertionError, ImportError):
-            raise AssertionError(
-                "Weechat requires callbacks to exist in global scope of the source script. Use `{} = {}.shutdown; {}.install()`".format(
-                    shutdown_name,
-                    self.__class__.__name__.lower(),
-                    self.__class__.__name__.lower(),
-                )
-            )
+        from api.debug import assert_global
+
+        assert_global(
+            shutdown_name,
+            self.shutdown,
+            "{} = {}.shutdown; {}.install()".format(
+                shutdown_name,
+                self.__class__.__name__.lower(),
+                self.__class__.__name__.lower(),
+            ),
+        )
 
         self.ptr = w.register(
             self.name,
@@ -676,10 +2132,43 @@ class Script:
             "UTF-8",
         )
 
+        for config in self.configs:
+            try:
+                config.hook(self.name)
+            except Exception as e:
+                w.prnt(
+                    "",
+                    "Failed to hook config {}: {}".format(
+                        config.__class__.__name__, "; ".join(e.args)
+                    ),
+                )
+
+        state = self.load_state()
+        for command in self.commands:
+            command.restore(state["commands"].get(command.name, {}))
+        for event in self.events:
+            event.restore(state["events"].get(event.callback_name, {}))
+
+        self.sync_hooks()
+
+        # self.event_hooks.append(w.hook_signal("*,irc_in_*", "irc_raw_in_cb", ""))
+        self.on_register()
+
+    def sync_hooks(self):
+        """Install missing hooks and replace those whose arguments changed
+
+        Hooks that are already installed with the same arguments are left alone,
+        so calling this again after changing an event or command only touches
+        what changed.
+        """
         for command in self.commands:
             try:
-                command.hook()
-                self.command_hooks.append(command)
+                if command.ptr is None:
+                    command.hook()
+                    self.command_hooks.append(command)
+                elif command.hooked_spec != command.spec():
+                    command.unhook()
+                    command.hook()
             except Exception as e:
                 w.prnt(
                     "",
@@ -690,8 +2179,11 @@ class Script:
 
         for event in self.events:
             try:
-                event.hook()
-                self.event_hooks.append(event)
+                if event.ptr is None:
+                    event.hook()
+                    self.event_hooks.append(event)
+                elif event.hooked_spec != event.spec():
+                    event.rehook()
             except Exception as e:
                 w.prnt(
                     "",
@@ -700,47 +2192,106 @@ class Script:
                     ),
                 )
 
-        # self.event_hooks.append(w.hook_signal("*,irc_in_*", "irc_raw_in_cb", ""))
-        self.on_register()
-
     def shutdown(self):
         self.before_shutdown()
-        w.unhook_all()
-
-        # for command in self.command_hooks:
-        #     try:
-        #         command.unhook()
-        #     except Exception as e:
-        #         w.prnt(
-        #             "",
-        #             "Failed to unhook command {}: {}".format(
-        #                 command.name, "; ".join(e.args)
-        #             ),
-        #         )
+        flush_batches()
+        for callback in _shutdown_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                w.prnt("", "Failed to run shutdown callback: {}".format(e))
+        _shutdown_callbacks.clear()
+        self.save_state()
+
+        for command in self.command_hooks:
+            try:
+                command.unhook()
+            except Exception as e:
+                w.prnt(
+                    "",
+                    "Failed to unhook command {}: {}".format(
+                        command.name, "; ".join(e.args)
+                    ),
+                )
         self.command_hooks.clear()
 
-        # for event in self.event_hooks:
-        #     try:
-        #         event.unhook()
-        #     except Exception as e:
-        #         w.prnt(
-        #             "",
-        #             "Failed to unhook event {}: {}".format(
-        #                 event.__class__.__name__, "; ".join(e.args)
-        #             ),
-        #         )
+        for event in self.event_hooks:
+            try:
+                event.unhook()
+            except Exception as e:
+                w.prnt(
+                    "",
+                    "Failed to unhook event {}: {}".format(
+                        event.__class__.__name__, "; ".join(e.args)
+                    ),
+                )
         self.event_hooks.clear()
 
+        for config in self.configs:
+            if config.ptr is not None:
+                config.unhook()
+
+        clear_timeouts()
+
         return ReturnCode.OK.value
 
+    def state_path(self) -> str:
+        data_dir = w.info_get("weechat_data_dir", "") or w.info_get("weechat_dir", "")
+        return os.path.join(data_dir, "{}.state.json".format(self.name.lower()))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Collect the reload state of every command and event"""
+        return {
+            "commands": {c.name: c.snapshot() for c in self.commands},
+            "events": {e.callback_name: e.snapshot() for e in self.events},
+        }
+
+    def save_state(self):
+        import json
+
+        try:
+            with open(self.state_path(), "w") as f:
+                json.dump(self.snapshot(), f, separators=(",", ":"))
+        except (OSError, TypeError, ValueError) as e:
+            w.prnt("", "Failed to save script state: {}".format(e))
+
+    def load_state(self) -> Dict[str, Dict[str, Any]]:
+        """Read and remove the state saved by the previous shutdown, if any"""
+        import json
+
+        path = self.state_path()
+        state: Dict[str, Dict[str, Any]] = {"commands": {}, "events": {}}
+        try:
+            with open(path) as f:
+                state.update(json.load(f))
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            w.prnt("", "Failed to load script state: {}".format(e))
+        return state
+
     def register_command(self, command: Command) -> Callable[[str, str, str], int]:
         self.commands.append(command)
         return command.callback
 
-    def register_event(self, event: Event) -> Callable[[str, dict], dict]:
+    def register_event(
+        self,
+        event: Event,
+        batch: int = 0,
+        batch_ms: int = 1000,
+        priority: Priority = Priority.NORMAL,
+    ) -> Callable[[str, dict], dict]:
+        event.priority = priority
+        if batch > 0:
+            event.set_batch(batch, batch_ms)
         self.events.append(event)
         return event._callback
 
+    def register_config(self, config: Config) -> Callable[[str, str, str], int]:
+        self.configs.append(config)
+        return config._callback
+
     def before_shutdown(self):
         """This function is called before shutting down the script"""
         pass
@@ -755,10 +2306,13 @@ def prnt(buffer: str, text: str):
 
 
 _timers: Dict[str, Callable[[int], Any]] = {}
+_timer_hooks: Dict[str, str] = {}
+_timer_ids = count()
 
 
 def timer_callback(data: str, remaining_calls: str) -> int:
     cb = _timers.pop(data, None)
+    _timer_hooks.pop(data, None)
     if cb:
         cb(int(remaining_calls))
     return ReturnCode.OK.value
@@ -767,19 +2321,51 @@ def timer_callback(data: str, remaining_calls: str) -> int:
 def _cancel_timer(uuid: str, ptr: str):
     # w.prnt("", f"canceling timer {uuid = } {ptr = }")
     _timers.pop(uuid, None)
-    w.unhook(ptr)
+    if _timer_hooks.pop(uuid, None) is not None:
+        w.unhook(ptr)
 
 
 def set_timeout(delay: int, cb: Callable[[int], Any]) -> Callable:
-    uuid = str(uuid4())
+    uuid = str(next(_timer_ids))
     _timers[uuid] = cb
     ptr = w.hook_timer(delay, 0, 1, "timer_callback", uuid)
+    _timer_hooks[uuid] = ptr
     # w.prnt("", f"setting timer {uuid = } {ptr = } {len(_timers)}")
     return lambda: _cancel_timer(uuid, ptr)
 
 
+def clear_timeouts():
+    """Cancel every pending timeout"""
+    for uuid, ptr in list(_timer_hooks.items()):
+        _cancel_timer(uuid, ptr)
+
+
 def say(target: str, msg: str):
     buf = w.buffer_search("==", target)
     ret = w.command(buf, f"/say {msg}")
     if ret == ReturnCode.ERROR:
-        raise RuntimeError("weechat.command() failed")
\ No newline at end of file
+        raise RuntimeError("weechat.command() failed")
+
+
+_LAZY_EXPORTS = {
+    "WorkerPool": "api.workers",
+    "ExportServer": "api.export",
+    "ExportClient": "api.export",
+    "Roster": "api.roster",
+    "Capture": "api.capture",
+    "CaptureCommand": "api.capture",
+    "Metrics": "api.metrics",
+    "TwitchPool": "api.pool",
+    "MemoryCommand": "api.memory",
+    "TrendTracker": "api.trending",
+    "TrendCommand": "api.trending",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module 'api' has no attribute '{}'".format(name))
+    from importlib import import_module
+
+    return getattr(import_module(module), name)
@@ -0,0 +1,195 @@
+import gzip
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, IO, List, Optional, Tuple
+
+import weechat as w
+
+import api
+from api import Command, ReturnCode, on_shutdown, set_capture
+
+
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd capture requires the zstandard package")
+    return zstandard
+
+
+def _open_zstd(path: str) -> IO[bytes]:
+    return _zstandard().ZstdCompressor().stream_writer(open(path, "wb"))
+
+
+class Capture:
+    """Records incoming traffic to compressed, size-rotated JSON lines files
+
+    While running, `Irc._callback` and `Event._callback` only append a tuple to
+    a deque. A writer thread drains it every `interval` seconds, serializes the
+    entries and compresses them into `<directory>/capture-<time>.jsonl.gz` (or
+    `.zst`). A new file is started once `max_bytes` of uncompressed data have
+    been written to the current one, and at most `keep` files are kept. If
+    the writer falls behind by more than `max_pending` entries, the oldest
+    are dropped and counted in `dropped` rather than queued without bound.
+
+    A running capture is stopped by `Script.shutdown`, so its thread is gone
+    and its file complete before WeeChat unloads the script. If the writer
+    fails, capturing stops and the exception is kept in `error`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compression: str = "gzip",
+        max_bytes: int = 64 << 20,
+        keep: int = 10,
+        interval: float = 0.5,
+        max_pending: int = 100000,
+    ):
+        if compression not in ("gzip", "zstd"):
+            raise ValueError("unknown compression: {}".format(compression))
+        if compression == "zstd":
+            _zstandard()
+        self.directory = directory
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.interval = interval
+        self.buffer: Deque[Tuple[Any, ...]] = deque(maxlen=max_pending)
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.file: Optional[IO[bytes]] = None
+        self.written = 0
+        self.records = 0
+        self.files: List[str] = []
+        self.error: Optional[Exception] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    @property
+    def dropped(self) -> int:
+        """Entries discarded because the writer fell behind, since the last start"""
+        return api._capture_dropped
+
+    def start(self):
+        assert self.thread is None, "Capture already running"
+        os.makedirs(self.directory, exist_ok=True)
+        self.stopping.clear()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self.thread.start()
+        set_capture(self.buffer)
+        on_shutdown(self.stop)
+
+    def stop(self):
+        """Stop capturing and wait for buffered entries to be written"""
+        thread = self.thread
+        if thread is None:
+            return
+        set_capture(None)
+        self.stopping.set()
+        thread.join()
+        self.thread = None
+
+    def _run(self):
+        try:
+            while not self.stopping.wait(self.interval):
+                self._drain()
+            self._drain()
+        except Exception as e:
+            # the weechat API isn't thread-safe, so the error is reported by
+            # /apicapture status rather than printed from here
+            self.error = e
+            set_capture(None)
+            self.thread = None
+        finally:
+            if self.file is not None:
+                try:
+                    self.file.close()
+                except Exception:
+                    pass
+                self.file = None
+
+    def _drain(self):
+        buffer = self.buffer
+        block = []
+        while buffer:
+            entry = buffer.popleft()
+            if entry[1] == "irc":
+                record = {"t": entry[0], "signal": entry[2], "line": entry[3]}
+            else:
+                record = {"t": entry[0], "event": entry[2], "htable": entry[3]}
+            block.append(json.dumps(record, separators=(",", ":")))
+        if not block:
+            return
+
+        data = ("\n".join(block) + "\n").encode()
+        if self.file is None or self.written >= self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.written += len(data)
+        self.records += len(block)
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        if self.compression == "zstd":
+            path = os.path.join(self.directory, "capture-{}.jsonl.zst".format(stamp))
+            self.file = _open_zstd(path)
+        else:
+            path = os.path.join(self.directory, "capture-{}.jsonl.gz".format(stamp))
+            self.file = gzip.open(path, "wb", compresslevel=6)
+        self.written = 0
+
+        self.files.append(path)
+        while len(self.files) > self.keep:
+            try:
+                os.remove(self.files.pop(0))
+            except OSError:
+                pass
+
+
+class CaptureCommand(Command):
+    def __init__(self, capture: Capture, name: str = "apicapture"):
+        """Toggles traffic capture: /apicapture on|off|status"""
+        super().__init__(
+            name,
+            "record incoming IRC lines and buffer lines to compressed files",
+            "on|off|status",
+            "on: start capturing\n"
+            "off: stop capturing and flush\n"
+            "status: show progress",
+            "on|off|status",
+        )
+        self.capture = capture
+
+    def callback(self, data: str, buffer: str, args: str) -> int:
+        action = args.strip() or "status"
+        capture = self.capture
+        if action == "on" and not capture.running:
+            capture.start()
+        elif action == "off":
+            capture.stop()
+        elif action != "status" and action != "on":
+            return ReturnCode.ERROR.value
+
+        if capture.error is not None:
+            w.prnt(buffer, "capture failed: {}".format(capture.error))
+        w.prnt(
+            buffer,
+            "capture {}: {} records, {} pending, {} dropped, writing {}".format(
+                "on" if capture.running else "off",
+                capture.records,
+                len(capture.buffer),
+                capture.dropped,
+                capture.files[-1] if capture.files else "nothing",
+            ),
+        )
+        return ReturnCode.OK.value
@@ -0,0 +1,47 @@
+"""Callsite checks run when hooks are installed
+
+WeeChat finds callbacks by name in the script's global scope, so these verify
+that the function handed to WeeChat is reachable under the name it was given.
+They need `inspect`, which is slow to import, so `api` only loads this module
+the first time a hook is installed.
+"""
+
+import inspect
+import os
+
+import weechat as w
+
+_API_INIT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__init__.py")
+
+
+def assert_global(name: str, value: object, usage: str):
+    """Check that the first caller outside `api` has `value` bound to `name`
+
+    Raises:
+        AssertionError: Raises with a hint built from `usage` if it doesn't
+    """
+    for frame in inspect.stack(0):
+        if os.path.abspath(frame.filename) not in (_API_INIT, __file__):
+            module = inspect.getmodule(frame.frame)
+            if module is not None and getattr(module, name, None) == value:
+                return
+            break
+    raise AssertionError(
+        "Weechat requires callbacks to exist in global scope of the source script. Use `{}`".format(
+            usage
+        )
+    )
+
+
+def assert_named_correctly(callback_name: str, method: str = "callback"):
+    for frame in inspect.stack():
+        if frame.code_context and f".{method}(" in frame.code_context[0]:
+            left, right = frame.code_context[0].strip(" \r\n").split("=")
+            left = left.strip()
+            right = right.strip()
+            if left == callback_name:
+                return
+            raise AssertionError(
+                f"Weechat requires callbacks to exist in global scope of the source script. Use `{callback_name} = {right}`"
+            )
+    w.prnt("", "could not identify callsite, can't verify callback is named correctly")
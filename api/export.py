@@ -0,0 +1,280 @@
+import json
+import os
+import re
+import socket
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import weechat as w
+
+from api import (
+    Glob,
+    IrcMessage,
+    Matcher,
+    MessageFilterLambda,
+    RegExp,
+    ReturnCode,
+    String,
+    assert_named_correctly,
+    match_message,
+)
+
+FilterSpec = Union[None, str, Dict[str, str]]
+
+
+def parse_matcher(spec: FilterSpec) -> Optional[Matcher]:
+    """Build a Matcher from its JSON form
+
+    `null` matches anything, a string matches exactly, and `{"glob": ...}` or
+    `{"regexp": ...}` build a Glob or RegExp.
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        return String(spec)
+    if "glob" in spec:
+        return Glob(spec["glob"])
+    if "regexp" in spec:
+        return RegExp(spec["regexp"])
+    raise ValueError("unknown matcher: {}".format(spec))
+
+
+def message_dict(msg: IrcMessage) -> Dict[str, Any]:
+    return {
+        "server": msg.server,
+        "command": msg.command,
+        "nick": msg.nick,
+        "user": msg.user,
+        "host": msg.host,
+        "params": msg.params,
+        "tags": msg.tags,
+        "display_name": getattr(msg, "display_name", msg.nick),
+    }
+
+
+class Connection:
+    """The server's side of a connected client"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.inbuf = b""
+        self.outbuf = bytearray()
+        self.read_hook: Optional[str] = None
+        self.write_hook: Optional[str] = None
+
+
+class ExportServer:
+    """Streams parsed IRC messages to local subscribers over a Unix socket
+
+    Clients send newline-delimited JSON subscriptions, e.g.
+    `{"command": "PRIVMSG", "params": ["#dunkorslam", {"glob": "!*"}]}`, and
+    receive every matching message as one JSON object per line. Output that a
+    client doesn't read is buffered up to `max_buffer` bytes, after which the
+    client is disconnected rather than slowing down WeeChat.
+
+    Feed it by registering `publish` as an Irc handler:
+    `irc.on(export.publish, "PRIVMSG")`.
+    """
+
+    def __init__(self, path: str, max_buffer: int = 1 << 20):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.sock: Optional[socket.socket] = None
+        self.hook: Optional[str] = None
+        self.callback_name = ""
+        self.clients: Dict[int, Connection] = {}
+        self.subscriptions: Dict[str, List[Tuple[Connection, MessageFilterLambda]]] = {}
+        self.dropped = 0
+
+    def callback(self, callback_name: str) -> Callable[[str, str], int]:
+        """Start listening; store the result under `callback_name` in global scope"""
+        assert self.sock is None, "ExportServer already listening"
+        assert_named_correctly(callback_name)
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen()
+
+        self.sock = sock
+        self.callback_name = callback_name
+        self.hook = w.hook_fd(sock.fileno(), 1, 0, 0, callback_name, "accept")
+        return self._callback
+
+    def close(self):
+        for client in list(self.clients.values()):
+            self._drop(client)
+        if self.hook is not None:
+            w.unhook(self.hook)
+            self.hook = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            os.unlink(self.path)
+
+    def publish(self, server: str, msg: IrcMessage) -> ReturnCode:
+        subs = self.subscriptions.get(msg.command)
+        if not subs:
+            return ReturnCode.OK
+
+        line = None
+        sent = set()
+        for client, filter in tuple(subs):
+            if id(client) in sent or not filter(msg):
+                continue
+            if line is None:
+                line = json.dumps(message_dict(msg), separators=(",", ":")).encode()
+                line += b"\n"
+            sent.add(id(client))
+            self._send(client, line)
+        return ReturnCode.OK
+
+    def _callback(self, data: str, fd: str) -> int:
+        if data == "accept":
+            self._accept()
+        elif data.startswith("w"):
+            client = self.clients.get(int(data[1:]))
+            if client is not None:
+                self._flush(client)
+        else:
+            client = self.clients.get(int(data))
+            if client is not None:
+                self._read(client)
+        return ReturnCode.OK.value
+
+    def _accept(self):
+        try:
+            sock, _ = self.sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = Connection(sock)
+        fd = sock.fileno()
+        self.clients[fd] = client
+        client.read_hook = w.hook_fd(fd, 1, 0, 0, self.callback_name, str(fd))
+
+    def _read(self, client: Connection):
+        try:
+            chunk = client.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._drop(client)
+            return
+
+        lines = (client.inbuf + chunk).split(b"\n")
+        client.inbuf = lines.pop()
+        if len(client.inbuf) > self.max_buffer:
+            self._drop(client)
+            return
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                spec = json.loads(line)
+                matchers = [parse_matcher(p) for p in spec.get("params", [])]
+                command = spec["command"].upper()
+            except (KeyError, ValueError, TypeError, AttributeError, re.error) as e:
+                self._send(client, json.dumps({"error": str(e)}).encode() + b"\n")
+                continue
+            self.subscriptions.setdefault(command, []).append(
+                (client, match_message(command, matchers))
+            )
+
+    def _send(self, client: Connection, line: bytes):
+        # while output is queued the write hook is pending, and only it sends,
+        # so lines stay in order and a backlogged client costs one append
+        if client.write_hook is None:
+            try:
+                sent = client.sock.send(line)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._drop(client)
+                return
+            if sent == len(line):
+                return
+            line = line[sent:]
+
+        client.outbuf += line
+        if len(client.outbuf) > self.max_buffer:
+            self.dropped += 1
+            self._drop(client)
+            return
+        if client.write_hook is None:
+            fd = client.sock.fileno()
+            client.write_hook = w.hook_fd(
+                fd, 0, 1, 0, self.callback_name, "w{}".format(fd)
+            )
+
+    def _flush(self, client: Connection):
+        buf = client.outbuf
+        try:
+            sent = client.sock.send(buf)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop(client)
+            return
+
+        del buf[:sent]
+        if not buf and client.write_hook is not None:
+            w.unhook(client.write_hook)
+            client.write_hook = None
+
+    def _drop(self, client: Connection):
+        fd = client.sock.fileno()
+        for hook in (client.read_hook, client.write_hook):
+            if hook is not None:
+                w.unhook(hook)
+        client.read_hook = client.write_hook = None
+        for command, subs in list(self.subscriptions.items()):
+            subs[:] = [s for s in subs if s[0] is not client]
+            if not subs:
+                del self.subscriptions[command]
+        self.clients.pop(fd, None)
+        client.sock.close()
+
+
+class ExportClient:
+    """Blocking client for an ExportServer, for external consumers and tests
+
+    Example:
+        with ExportClient(path) as sub:
+            sub.subscribe("PRIVMSG", ["#dunkorslam", {"glob": "!*"}])
+            for msg in sub:
+                print(msg["display_name"], msg["params"][-1])
+    """
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.buf = b""
+
+    def __enter__(self) -> "ExportClient":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def subscribe(self, command: str, params: List[FilterSpec] = []):
+        spec = {"command": command, "params": params}
+        self.sock.sendall(json.dumps(spec).encode() + b"\n")
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        while True:
+            while b"\n" not in self.buf:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    return
+                self.buf += chunk
+            line, self.buf = self.buf.split(b"\n", 1)
+            yield json.loads(line)
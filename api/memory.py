@@ -0,0 +1,215 @@
+import os
+import sys
+from collections import deque
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+import weechat as w
+
+import api
+from api import Command, ReturnCode
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# followed no further: code and classes are shared, not owned by a registry
+_OPAQUE = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+_LEAVES = (str, bytes, bytearray, int, float, bool, complex, memoryview, type(None))
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> Tuple[int, int]:
+    """Return (objects, bytes) reachable from `obj`, counting each object once
+
+    Containers, instance dicts and slots are followed; functions, methods,
+    classes and modules are counted but not followed, so a registry of
+    callbacks doesn't pull in everything the callbacks refer to.
+    """
+    if seen is None:
+        seen = set()
+    count = size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        count += 1
+        size += sys.getsizeof(o)
+
+        if isinstance(o, _LEAVES) or isinstance(o, _OPAQUE):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        else:
+            d = getattr(o, "__dict__", None)
+            if d is not None:
+                stack.append(d)
+            for cls in type(o).__mro__:
+                for slot in cls.__dict__.get("__slots__", ()):
+                    value = getattr(o, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return count, size
+
+
+def module_registries() -> Dict[str, Any]:
+    """The module-level registries of api"""
+    return {
+        "timers": api._timers,
+        "timer hooks": api._timer_hooks,
+        "batches": api._batches,
+        "badge cache": api._badge_cache,
+        "emote cache": api._emote_cache,
+        "shedder counters": (api.load_shedder.dropped, api.load_shedder.deferred),
+    }
+
+
+_class_ranges: Dict[str, List[Tuple[int, int, str]]] = {}
+
+
+def _owner(filename: str, lineno: int) -> str:
+    """`module.Class` for a line inside a class, `module` otherwise"""
+    module = os.path.splitext(os.path.relpath(filename, _API_DIR))[0]
+    module = "api" if module == "__init__" else "api." + module.replace(os.sep, ".")
+
+    ranges = _class_ranges.get(filename)
+    if ranges is None:
+        import ast
+
+        try:
+            with open(filename) as f:
+                tree = ast.parse(f.read())
+            ranges = [
+                (node.lineno, node.end_lineno or node.lineno, node.name)
+                for node in ast.walk(tree)
+                if isinstance(node, ast.ClassDef)
+            ]
+        except (OSError, SyntaxError):
+            ranges = []
+        _class_ranges[filename] = ranges
+
+    # innermost class containing the line
+    owner, owner_start = "", 0
+    for start, end, name in ranges:
+        if start <= lineno <= end and start > owner_start:
+            owner, owner_start = name, start
+    return "{}.{}".format(module, owner) if owner else module
+
+
+class MemoryCommand(Command):
+    """Reports memory held by api registries: /apimem [trace on|off|reset]
+
+    Without arguments, prints the object count and approximate size of every
+    module-level registry and of the objects passed to `track`, including
+    their container attributes. With tracing on, also prints how allocations
+    made from api code changed since the previous /apimem, grouped by module
+    and class. Tracing uses tracemalloc, which slows down every allocation,
+    so it is off until `/apimem trace on`.
+    """
+
+    def __init__(self, name: str = "apimem", top: int = 15):
+        super().__init__(
+            name,
+            "show memory held by api registries",
+            "[trace on|off|reset]",
+            "trace on: start tracing allocations from api code\n"
+            "trace off: stop tracing and drop the snapshots\n"
+            "trace reset: take a new baseline snapshot",
+            "trace on|off|reset",
+        )
+        self.top = top
+        self.tracked: Dict[str, Any] = {}
+        self.trace_baseline: Optional[Any] = None
+        self.started = False
+
+    def track(self, name: str, obj: Any):
+        """Include `obj`, e.g. an Irc, Script or Event, in the report"""
+        self.tracked[name] = obj
+
+    def callback(self, data: str, buffer: str, args: str) -> int:
+        words = args.split()
+        if words[:1] == ["trace"]:
+            action = words[1] if len(words) > 1 else ""
+            if action == "on":
+                self.trace_on()
+            elif action == "off":
+                self.trace_off()
+            elif action == "reset" and self.trace_baseline is not None:
+                self.trace_baseline = self.take_snapshot()
+            else:
+                return ReturnCode.ERROR.value
+            tracing = self.trace_baseline is not None
+            w.prnt(buffer, "tracing {}".format("on" if tracing else "off"))
+            return ReturnCode.OK.value
+        elif words:
+            return ReturnCode.ERROR.value
+
+        for line in self.report():
+            w.prnt(buffer, line)
+        if self.trace_baseline is not None:
+            for line in self.trace_report():
+                w.prnt(buffer, line)
+        return ReturnCode.OK.value
+
+    def report(self) -> List[str]:
+        lines = ["{:<36} {:>9} {:>12}".format("registry", "objects", "bytes")]
+
+        def row(name: str, obj: Any):
+            count, size = deep_sizeof(obj)
+            lines.append("{:<36} {:>9} {:>12}".format(name, count, size))
+
+        for name, obj in module_registries().items():
+            row(name, obj)
+        for name, obj in self.tracked.items():
+            row(name, obj)
+            for attr, value in sorted(getattr(obj, "__dict__", {}).items()):
+                if isinstance(value, (dict, list, set, deque)):
+                    row("  {}.{} ({})".format(name, attr, len(value)), value)
+        return lines
+
+    def take_snapshot(self) -> Any:
+        import tracemalloc
+
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, os.path.join(_API_DIR, "*"))]
+        )
+
+    def trace_on(self):
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+        self.trace_baseline = self.take_snapshot()
+
+    def trace_off(self):
+        import tracemalloc
+
+        self.trace_baseline = None
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def trace_report(self) -> List[str]:
+        previous = self.trace_baseline
+        current = self.trace_baseline = self.take_snapshot()
+
+        totals: Dict[str, List[int]] = {}
+        for stat in current.compare_to(previous, "lineno"):
+            frame = stat.traceback[0]
+            entry = totals.setdefault(_owner(frame.filename, frame.lineno), [0, 0, 0])
+            entry[0] += stat.size_diff
+            entry[1] += stat.count_diff
+            entry[2] += stat.size
+
+        ranked = sorted(totals.items(), key=lambda item: abs(item[1][0]), reverse=True)
+        lines = ["allocations since last /apimem, by owner:"]
+        for owner, (size_diff, count_diff, size) in ranked[: self.top]:
+            lines.append(
+                "  {:<34} {:>+10} B {:>+8} blocks, {:>10} B live".format(
+                    owner, size_diff, count_diff, size
+                )
+            )
+        return lines
@@ -0,0 +1,146 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import weechat as w
+
+from api import ReturnCode, _peek_target, assert_named_correctly, set_metrics
+
+
+class Meter:
+    """Message counter with a ring of recent per-tick counts and an EWMA rate
+
+    Counting is a single increment; the ring and the rate are only updated by
+    `tick`, which runs on the metrics timer.
+    """
+
+    __slots__ = ("pending", "ring", "pos", "total", "rate", "peak")
+
+    def __init__(self, size: int):
+        self.pending = 0
+        self.ring = [0] * size
+        self.pos = 0
+        self.total = 0
+        self.rate = 0.0
+        self.peak = 0.0
+
+    def tick(self, interval: float, alpha: float):
+        count = self.pending
+        self.pending = 0
+        self.ring[self.pos] = count
+        self.pos = (self.pos + 1) % len(self.ring)
+        self.total += count
+        current = count / interval
+        self.rate += alpha * (current - self.rate)
+        if current > self.peak:
+            self.peak = current
+
+    def window_rate(self, interval: float) -> float:
+        """Average rate over the whole ring, in messages per second"""
+        return sum(self.ring) / (len(self.ring) * interval)
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending and self.rate < 0.01 and not any(self.ring)
+
+
+class Metrics:
+    """Per-channel, per-buffer and per-command message rates
+
+    Once started, `Irc._callback` counts every incoming line against its
+    command and, for channel messages, against `irc.<server>.<channel>`, and
+    `Event._callback` counts displayed lines against their buffer. Every
+    `interval` seconds a timer folds the counts into the meters and refreshes
+    the `name` bar item, which shows the rates of the current buffer.
+
+    Args:
+        interval (float): Seconds between ticks
+        window (int): Number of ticks kept in each meter's ring
+        halflife (float): Seconds for the EWMA to weigh an old rate by half
+        name (str): Name of the bar item
+    """
+
+    def __init__(
+        self,
+        interval: float = 2.0,
+        window: int = 30,
+        halflife: float = 10.0,
+        name: str = "api_rates",
+    ):
+        self.interval = interval
+        self.window = window
+        self.alpha = 1 - 0.5 ** (interval / halflife)
+        self.name = name
+        self.channels: Dict[str, Meter] = {}
+        self.buffers: Dict[str, Meter] = {}
+        self.commands: Dict[str, Meter] = {}
+        self.total = Meter(window)
+        self.item: Optional[str] = None
+        self.timer: Optional[str] = None
+
+    def _count(self, meters: Dict[str, Meter], key: str):
+        meter = meters.get(key)
+        if meter is None:
+            meter = meters[key] = Meter(self.window)
+        meter.pending += 1
+
+    def irc(self, server: str, command: str, line: str):
+        self.total.pending += 1
+        self._count(self.commands, command)
+        target = _peek_target(line)
+        if target[:1] in ("#", "&"):
+            self._count(self.channels, "irc.{}.{}".format(server, target))
+
+    def line(self, buffer_name: str):
+        self._count(self.buffers, buffer_name)
+
+    def tick(self):
+        interval = self.interval
+        alpha = self.alpha
+        self.total.tick(interval, alpha)
+        for meters in (self.channels, self.buffers, self.commands):
+            for key, meter in list(meters.items()):
+                meter.tick(interval, alpha)
+                if meter.idle:
+                    del meters[key]
+
+    def top(self, meters: Dict[str, Meter], count: int = 10) -> List[Tuple[str, Meter]]:
+        """The `count` busiest meters by EWMA rate"""
+        ranked = sorted(meters.items(), key=lambda item: item[1].rate, reverse=True)
+        return ranked[:count]
+
+    def render(self, buffer_name: str) -> str:
+        meter = self.channels.get(buffer_name) or self.buffers.get(buffer_name)
+        text = "in {:.1f}/s".format(self.total.rate)
+        if meter is not None:
+            text += " here {:.1f}/s (peak {:.1f})".format(meter.rate, meter.peak)
+        return text
+
+    def callback(self, callback_name: str) -> Callable[..., object]:
+        """Start counting; store the result under `callback_name` in global scope"""
+        assert self.timer is None, "Metrics already running"
+        assert_named_correctly(callback_name)
+
+        self.item = w.hook_bar_item(self.name, callback_name, "item")
+        self.timer = w.hook_timer(
+            int(self.interval * 1000), 0, 0, callback_name, "tick"
+        )
+        set_metrics(self)
+        return self._callback
+
+    def stop(self):
+        set_metrics(None)
+        if self.timer is not None:
+            w.unhook(self.timer)
+            self.timer = None
+        if self.item is not None:
+            w.bar_item_remove(self.item)
+            self.item = None
+
+    def _callback(self, data: str, *args) -> object:
+        if data == "tick":
+            self.tick()
+            w.bar_item_update(self.name)
+            return ReturnCode.OK.value
+
+        # bar item: (item, window, buffer, extra_info)
+        buffer = args[2] if len(args) > 2 else ""
+        return self.render(w.buffer_get_string(buffer, "full_name") if buffer else "")
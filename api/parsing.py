@@ -0,0 +1,55 @@
+"""pydle-backed IRC line parsing
+
+pydle and its dependencies take longer to import than the rest of `api`
+combined, so `IrcMessage` loads this module when it parses its first line.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from pydle.features.ircv3.tags import TaggedMessage
+from pydle.features.ctcp import is_ctcp, construct_ctcp, parse_ctcp
+from pydle.features.rfc1459.parsing import parse_user
+
+__all__ = ["construct_ctcp", "parse_line"]
+
+ParsedLine = Tuple[
+    Optional[str],
+    Optional[str],
+    Optional[str],
+    Optional[str],
+    str,
+    List[str],
+    Dict[str, str],
+]
+
+
+def parse_line(line: str) -> ParsedLine:
+    """Split a raw line into (source, nick, user, host, command, params, tags)
+
+    Numerics are zero-padded to three digits, and CTCP requests and replies
+    become `CTCP_<TYPE>` and `CTCPREPLY_<TYPE>` commands with the CTCP
+    arguments as their second parameter.
+    """
+    msg = TaggedMessage.parse(line.encode())
+
+    source = msg.source
+    if source:
+        nick, user, host = parse_user(source)
+    else:
+        nick, user, host = None, None, None
+
+    if isinstance(msg.command, int):
+        command = f"{msg.command:03}"
+    else:
+        command = msg.command.upper()
+
+    params = msg.params
+
+    if command == "PRIVMSG" or command == "NOTICE":
+        if len(params) > 1 and is_ctcp(params[1]):
+            type, args = parse_ctcp(params[1])
+            prefix = "CTCP_" if command == "PRIVMSG" else "CTCPREPLY_"
+            command = f"{prefix}{type.upper()}"
+            params = [params[0], args] if args else [params[0]]
+
+    return source, nick, user, host, command, params, msg.tags
@@ -0,0 +1,230 @@
+from collections import deque
+from time import monotonic
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import weechat as w
+
+from api import ReturnCode, TwitchIrc, _peek_target, casefold, set_timeout
+
+
+class TokenBucket:
+    """Allows `capacity` events per `period` seconds, refilling continuously"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.last = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait(self) -> float:
+        """Seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class PoolConnection:
+    """One WeeChat IRC server in a TwitchPool, and the channels assigned to it"""
+
+    __slots__ = ("name", "channels", "lines", "sampled_lines", "sampled_at", "rate")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.channels: Set[str] = set()
+        self.lines = 0
+        self.sampled_lines = 0
+        self.sampled_at = monotonic()
+        self.rate = 0.0
+
+    def sample(self, now: float) -> float:
+        """Update and return the inbound line rate, in lines per second"""
+        elapsed = now - self.sampled_at
+        if elapsed >= 1:
+            self.rate = (self.lines - self.sampled_lines) / elapsed
+            self.sampled_lines = self.lines
+            self.sampled_at = now
+        return self.rate
+
+
+class TwitchPool(TwitchIrc):
+    """Spreads Twitch channels over several IRC connections
+
+    The pool owns the WeeChat server `base` and `size - 1` copies of it named
+    `<base>-1`, `<base>-2`, ... Channels passed to `join` are assigned to the
+    connection with the fewest channels, breaking ties by inbound line rate,
+    and joined at most `joins` per `join_period` seconds across the pool.
+
+    Handlers registered with `on` and `modify` see lines from every
+    connection in the pool as coming from `base`, so they work the same no
+    matter which connection delivered a line. Lines from other servers, and
+    channel lines from a connection the channel isn't assigned to, are
+    ignored. Joins are paced with `set_timeout`, so `timer_callback` must be
+    in the script's global scope.
+
+    Args:
+        base (str): Name of the configured WeeChat server to copy
+        size (int): Number of connections, including `base`
+        max_channels (int): Channels per connection before it's considered full
+        joins (int): Joins allowed per `join_period`
+        join_period (float): Seconds over which `joins` are allowed
+    """
+
+    def __init__(
+        self,
+        base: str = "twitch",
+        size: int = 2,
+        max_channels: int = 100,
+        joins: int = 20,
+        join_period: float = 10.0,
+    ):
+        super().__init__()
+        self.base = base
+        self.max_channels = max_channels
+        self.bucket = TokenBucket(joins, join_period)
+        self.connections: Dict[str, PoolConnection] = {
+            name: PoolConnection(name)
+            for name in [base] + ["{}-{}".format(base, i) for i in range(1, size)]
+        }
+        self.assigned: Dict[str, PoolConnection] = {}
+        self.pending: Deque[Tuple[PoolConnection, str]] = deque()
+        self.cancel_drain: Optional[Callable] = None
+
+    def connect(self):
+        """Create missing server copies and connect every connection"""
+        for name in self.connections:
+            if name != self.base and not w.config_get(
+                "irc.server.{}.addresses".format(name)
+            ):
+                w.command("", "/server copy {} {}".format(self.base, name))
+                # the copy would otherwise join every channel of the base too
+                w.command("", '/set irc.server.{}.autojoin ""'.format(name))
+            w.command("", "/connect {}".format(name))
+
+    def _key(self, channel: str) -> str:
+        channel = channel if channel.startswith("#") else "#" + channel
+        # Twitch channel names are case-insensitive whatever handlers match
+        return casefold(channel, self.casemapping or "ascii")
+
+    def _least_loaded(self) -> PoolConnection:
+        now = monotonic()
+        candidates = [
+            c for c in self.connections.values() if len(c.channels) < self.max_channels
+        ] or list(self.connections.values())
+        return min(candidates, key=lambda c: (len(c.channels), c.sample(now)))
+
+    def join(self, channel: str) -> str:
+        """Queue a join on the least loaded connection; returns its server name"""
+        key = self._key(channel)
+        conn = self.assigned.get(key)
+        if conn is not None:
+            return conn.name
+
+        conn = self._least_loaded()
+        conn.channels.add(key)
+        self.assigned[key] = conn
+        self.pending.append((conn, key))
+        if self.cancel_drain is None:
+            self._drain()
+        return conn.name
+
+    def part(self, channel: str):
+        key = self._key(channel)
+        conn = self.assigned.pop(key, None)
+        if conn is None:
+            return
+        conn.channels.discard(key)
+        try:
+            self.pending.remove((conn, key))
+        except ValueError:
+            w.command("", "/quote -server {} PART {}".format(conn.name, key))
+
+    def server_of(self, channel: str) -> Optional[str]:
+        conn = self.assigned.get(self._key(channel))
+        return conn.name if conn is not None else None
+
+    def buffer_name(self, channel: str) -> Optional[str]:
+        """The WeeChat buffer of `channel`, on whichever connection joined it"""
+        server = self.server_of(channel)
+        return "irc.{}.{}".format(server, self._key(channel)) if server else None
+
+    def say(self, channel: str, text: str):
+        buffer_name = self.buffer_name(channel)
+        if buffer_name is None:
+            raise KeyError("channel not in pool: {}".format(channel))
+        buf = w.buffer_search("==", buffer_name)
+        if w.command(buf, "/say {}".format(text)) == ReturnCode.ERROR.value:
+            raise RuntimeError("weechat.command() failed")
+
+    def _drain(self, remaining: int = 0):
+        self.cancel_drain = None
+        while self.pending and self.bucket.take():
+            conn, channel = self.pending.popleft()
+            w.command("", "/join -noswitch -server {} {}".format(conn.name, channel))
+        if self.pending:
+            delay = max(1, int(self.bucket.wait() * 1000))
+            self.cancel_drain = set_timeout(delay, self._drain)
+
+    def _adopt(self, server: str, command: str, line: str):
+        # channels joined outside the pool (autojoin, /join) are tracked too,
+        # from our own JOIN and PART echoes
+        conn = self.connections[server]
+        parts = line.split(" ", 4)
+        if line.startswith("@"):
+            parts = parts[1:]
+        if len(parts) < 3 or not parts[0].startswith(":"):
+            return
+        nick = parts[0][1:].split("!", 1)[0]
+        if nick.lower() != (w.info_get("irc_nick", server) or "").lower():
+            return
+        key = self._key(parts[2].lstrip(":"))
+        current = self.assigned.get(key)
+        if command == "JOIN" and current is None:
+            conn.channels.add(key)
+            self.assigned[key] = conn
+        elif command == "PART" and current is conn:
+            conn.channels.discard(key)
+            del self.assigned[key]
+
+    def _owns(self, conn: PoolConnection, line: str) -> bool:
+        # a channel joined on two connections delivers every line twice
+        target = _peek_target(line)
+        if not target.startswith("#"):
+            return True
+        owner = self.assigned.get(self._key(target))
+        return owner is None or owner is conn
+
+    def _callback(self, data: str, signal: str, payload: str) -> ReturnCode:
+        server, _, rest = signal.partition(",")
+        conn = self.connections.get(server)
+        if conn is None:
+            return ReturnCode.OK
+        conn.lines += 1
+        if rest == "irc_raw_in_JOIN" or rest == "irc_raw_in_PART":
+            self._adopt(server, rest[11:], payload)
+        if not self._owns(conn, payload):
+            return ReturnCode.OK
+        return super()._callback(data, "{},{}".format(self.base, rest), payload)
+
+    def _modify(self, data: str, modifier: str, server: str, line: str) -> str:
+        conn = self.connections.get(server)
+        if conn is None or not self._owns(conn, line):
+            return line
+        return super()._modify(data, modifier, self.base, line)
+
+    def load(self) -> List[Tuple[str, int, float]]:
+        """(server, channels, lines per second) for every connection"""
+        now = monotonic()
+        return [
+            (c.name, len(c.channels), c.sample(now)) for c in self.connections.values()
+        ]
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Iterator, Mapping, Optional
+
+from api import Irc, IrcMessage, Priority, ReturnCode, decode_badges
+
+BROADCASTER = 1
+MODERATOR = 2
+VIP = 4
+SUBSCRIBER = 8
+TURBO = 16
+STAFF = 32
+
+_BADGE_FLAGS = {
+    "broadcaster": BROADCASTER,
+    "moderator": MODERATOR,
+    "vip": VIP,
+    "subscriber": SUBSCRIBER,
+    "founder": SUBSCRIBER,
+    "turbo": TURBO,
+    "staff": STAFF,
+    "admin": STAFF,
+    "global_mod": STAFF,
+}
+
+
+def badge_flags(badges: str) -> int:
+    """Fold a `badges` tag value into a bitmask of role flags"""
+    flags = 0
+    for badge in decode_badges(badges):
+        flags |= _BADGE_FLAGS.get(badge, 0)
+    return flags
+
+
+class TwitchUser:
+    __slots__ = (
+        "nick",
+        "user_id",
+        "display_name",
+        "flags",
+        "last_seen",
+        "banned_until",
+    )
+
+    def __init__(self, nick: str):
+        self.nick = nick
+        self.user_id = ""
+        self.display_name = nick
+        self.flags = 0
+        self.last_seen = 0.0
+        self.banned_until = 0.0
+
+    @property
+    def is_broadcaster(self) -> bool:
+        return bool(self.flags & BROADCASTER)
+
+    @property
+    def is_mod(self) -> bool:
+        return bool(self.flags & (MODERATOR | BROADCASTER))
+
+    @property
+    def is_vip(self) -> bool:
+        return bool(self.flags & VIP)
+
+    @property
+    def is_sub(self) -> bool:
+        return bool(self.flags & SUBSCRIBER)
+
+    @property
+    def is_banned(self) -> bool:
+        return self.banned_until > monotonic()
+
+
+class ChannelRoster:
+    """The users seen in one channel, least recently active first
+
+    Once more than `max_users` are tracked, the least recently active ones are
+    forgotten.
+    """
+
+    def __init__(self, name: str, max_users: int):
+        self.name = name
+        self.max_users = max_users
+        self.users: "OrderedDict[str, TwitchUser]" = OrderedDict()
+        self.by_id: Dict[str, TwitchUser] = {}
+        self.own: Optional[TwitchUser] = None
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __contains__(self, nick: str) -> bool:
+        return nick.lower() in self.users
+
+    def __iter__(self) -> Iterator[TwitchUser]:
+        return iter(self.users.values())
+
+    def get(self, nick: str) -> Optional[TwitchUser]:
+        return self.users.get(nick.lower())
+
+    def get_by_id(self, user_id: str) -> Optional[TwitchUser]:
+        return self.by_id.get(user_id)
+
+    def touch(self, nick: str) -> TwitchUser:
+        """Return the user for `nick`, creating it, and mark it as active"""
+        key = nick.lower()
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = TwitchUser(key)
+            if len(self.users) > self.max_users:
+                _, evicted = self.users.popitem(last=False)
+                if evicted.user_id:
+                    self.by_id.pop(evicted.user_id, None)
+        else:
+            self.users.move_to_end(key)
+        user.last_seen = monotonic()
+        return user
+
+    def update(self, user: TwitchUser, tags: Mapping[str, str]):
+        user_id = tags.get("user-id")
+        if user_id and user_id != user.user_id:
+            if user.user_id:
+                self.by_id.pop(user.user_id, None)
+            user.user_id = user_id
+            self.by_id[user_id] = user
+
+        display_name = tags.get("display-name")
+        if display_name and display_name is not True:
+            user.display_name = display_name
+
+        if "badges" in tags:
+            badges = tags["badges"]
+            user.flags = badge_flags(badges) if isinstance(badges, str) else 0
+
+    def remove(self, nick: str):
+        user = self.users.pop(nick.lower(), None)
+        if user is not None and user.user_id:
+            self.by_id.pop(user.user_id, None)
+
+
+class Roster:
+    """Per-channel Twitch user state, maintained from incoming message tags
+
+    Attach it to a TwitchIrc instance to keep it up to date from PRIVMSG,
+    USERSTATE, JOIN, PART and CLEARCHAT; lookups by nick or user-id are O(1).
+    """
+
+    def __init__(self, max_users: int = 10000):
+        self.max_users = max_users
+        self.channels: Dict[str, ChannelRoster] = {}
+
+    def attach(self, irc: Irc):
+        for command, handler in (
+            ("PRIVMSG", self.on_privmsg),
+            ("USERSTATE", self.on_userstate),
+            ("JOIN", self.on_join),
+            ("PART", self.on_part),
+            ("CLEARCHAT", self.on_clearchat),
+        ):
+            irc.on(handler, command, priority=Priority.HIGH)
+
+    def channel(self, name: str) -> ChannelRoster:
+        key = name.lower()
+        roster = self.channels.get(key)
+        if roster is None:
+            roster = self.channels[key] = ChannelRoster(key, self.max_users)
+        return roster
+
+    def get(self, channel: str, nick: str) -> Optional[TwitchUser]:
+        roster = self.channels.get(channel.lower())
+        return roster.get(nick) if roster else None
+
+    def get_by_id(self, channel: str, user_id: str) -> Optional[TwitchUser]:
+        roster = self.channels.get(channel.lower())
+        return roster.get_by_id(user_id) if roster else None
+
+    def on_privmsg(self, server: str, msg: IrcMessage) -> ReturnCode:
+        if msg.params and msg.nick:
+            roster = self.channel(msg.params[0])
+            roster.update(roster.touch(msg.nick), msg._peek_tags())
+        return ReturnCode.OK
+
+    def on_userstate(self, server: str, msg: IrcMessage) -> ReturnCode:
+        if msg.params:
+            roster = self.channel(msg.params[0])
+            if roster.own is None:
+                roster.own = TwitchUser("")
+            roster.update(roster.own, msg._peek_tags())
+        return ReturnCode.OK
+
+    def on_join(self, server: str, msg: IrcMessage) -> ReturnCode:
+        if msg.params and msg.nick:
+            self.channel(msg.params[0]).touch(msg.nick)
+        return ReturnCode.OK
+
+    def on_part(self, server: str, msg: IrcMessage) -> ReturnCode:
+        roster = self.channels.get(msg.params[0].lower()) if msg.params else None
+        if roster is not None and msg.nick:
+            roster.remove(msg.nick)
+        return ReturnCode.OK
+
+    def on_clearchat(self, server: str, msg: IrcMessage) -> ReturnCode:
+        # without a target nick the whole chat was cleared, which doesn't
+        # change who is in the channel
+        if len(msg.params) < 2:
+            return ReturnCode.OK
+
+        roster = self.channels.get(msg.params[0].lower())
+        user = roster.get(msg.params[1]) if roster else None
+        if user is not None:
+            duration = msg._peek_tags().get("ban-duration")
+            user.banned_until = (
+                monotonic() + int(duration) if duration else float("inf")
+            )
+        return ReturnCode.OK
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush, nlargest
+from time import monotonic
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+import weechat as w
+
+from api import Command, Event, LineFilter, Message, ReturnCode
+
+# renormalize once the forward-decay weight of a new hit reaches 2**_RESCALE
+_RESCALE = 40
+
+
+class SpaceSaving:
+    """Approximate top-K counter over a stream, with exponential time decay
+
+    Keeps at most `capacity` counters. A token that isn't tracked takes over
+    the smallest counter, inheriting its count as the error bound, so any
+    token whose decayed count exceeds 1/capacity of the total is guaranteed to
+    be tracked. Hits are weighted by forward decay: a hit at time t counts
+    2**((t - landmark) / halflife), which ages every counter at once without
+    touching them, and counts are rescaled before the weights get too large.
+    """
+
+    def __init__(self, capacity: int = 200, halflife: float = 60.0):
+        self.capacity = capacity
+        self.halflife = halflife
+        self.landmark = monotonic()
+        self.counts: Dict[str, List[float]] = {}
+        # min-heap of (count, token); entries go stale when a count grows and
+        # are skipped when they surface
+        self.heap: List[Tuple[float, str]] = []
+
+    def _weight(self, now: float) -> float:
+        exponent = (now - self.landmark) / self.halflife
+        if exponent > _RESCALE:
+            self._rescale(now)
+            exponent = 0.0
+        return 2.0**exponent
+
+    def _rescale(self, now: float):
+        scale = 2.0 ** (-(now - self.landmark) / self.halflife)
+        for entry in self.counts.values():
+            entry[0] *= scale
+            entry[1] *= scale
+        self.landmark = now
+        self._rebuild()
+
+    def _rebuild(self):
+        self.heap = [(entry[0], token) for token, entry in self.counts.items()]
+        heapify(self.heap)
+
+    def add(self, token: str, now: Optional[float] = None):
+        weight = self._weight(monotonic() if now is None else now)
+        counts = self.counts
+        heap = self.heap
+
+        entry = counts.get(token)
+        if entry is not None:
+            entry[0] += weight
+            heappush(heap, (entry[0], token))
+            if len(heap) > 4 * self.capacity:
+                self._rebuild()
+            return
+
+        if len(counts) < self.capacity:
+            counts[token] = [weight, 0.0]
+            heappush(heap, (weight, token))
+            return
+
+        while True:
+            count, victim = heappop(heap)
+            current = counts.get(victim)
+            if current is not None and current[0] == count:
+                break
+        del counts[victim]
+        counts[token] = [count + weight, count]
+        heappush(heap, (count + weight, token))
+
+    def top(
+        self, k: int = 10, now: Optional[float] = None
+    ) -> List[Tuple[str, float, float]]:
+        """The `k` heaviest tokens as (token, decayed count, error bound)"""
+        now = monotonic() if now is None else now
+        scale = 2.0 ** (-(now - self.landmark) / self.halflife)
+        heaviest = nlargest(k, self.counts.items(), key=lambda item: item[1][0])
+        return [(token, c * scale, e * scale) for token, (c, e) in heaviest]
+
+
+class TrendTracker(Event):
+    """Tracks which words, emotes and !commands are trending per channel
+
+    Each distinct token of a chat line counts once towards its channel's
+    SpaceSaving sketch, so memory is bounded by `capacity` counters for each
+    of at most `max_channels` channels, least recently active evicted first.
+
+    Args:
+        buffers (Iterable[str]): Buffer masks to watch, e.g. "irc.twitch.#*"
+        capacity (int): Counters kept per channel
+        halflife (float): Seconds after which a hit counts half as much
+        max_channels (int): Channels tracked at once
+        max_tokens (int): Distinct tokens counted per line
+    """
+
+    def __init__(
+        self,
+        buffers: Iterable[str] = ("*",),
+        capacity: int = 200,
+        halflife: float = 60.0,
+        max_channels: int = 100,
+        max_tokens: int = 32,
+    ):
+        self.capacity = capacity
+        self.halflife = halflife
+        self.max_channels = max_channels
+        self.max_tokens = max_tokens
+        self.channels: "OrderedDict[str, SpaceSaving]" = OrderedDict()
+
+        super().__init__(
+            "",
+            "",
+            "",
+            LineFilter(buffers=buffers, commands=["privmsg"], notify_levels=[1, 3]),
+        )
+
+    def sketch(self, channel: str) -> SpaceSaving:
+        sketch = self.channels.get(channel)
+        if sketch is None:
+            sketch = self.channels[channel] = SpaceSaving(self.capacity, self.halflife)
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(channel)
+        return sketch
+
+    def callback(self, msg: Message):
+        tokens = set(msg.message2.split()[: self.max_tokens])
+        if not tokens:
+            return
+        sketch = self.sketch(msg.buffer_name)
+        now = monotonic()
+        for token in tokens:
+            sketch.add(token, now)
+
+    def top(self, channel: str, k: int = 10) -> List[Tuple[str, float, float]]:
+        sketch = self.channels.get(channel)
+        return sketch.top(k) if sketch is not None else []
+
+    def suggest(
+        self, channel: str, exclude: Collection[str] = (), k: int = 5
+    ) -> List[str]:
+        """Trending !commands in `channel` that aren't in `exclude`"""
+        sketch = self.channels.get(channel)
+        if sketch is None:
+            return []
+        candidates = sketch.top(sketch.capacity)
+        return [
+            token
+            for token, _, _ in candidates
+            if token.startswith("!") and len(token) > 1 and token not in exclude
+        ][:k]
+
+
+class TrendCommand(Command):
+    def __init__(
+        self,
+        tracker: TrendTracker,
+        exclude: Optional[Collection[str]] = None,
+        name: str = "trending",
+    ):
+        """Shows trending tokens: /trending [suggest] [<buffer>] [<count>]
+
+        `exclude` is the collection of commands already tracked, e.g. a
+        CommandTracker's `commands`, which suggestions leave out.
+        """
+        super().__init__(
+            name,
+            "show the words, emotes and commands trending in a channel",
+            "[suggest] [<buffer>] [<count>]",
+            "suggest: list trending !commands that aren't tracked yet\n"
+            " buffer: full buffer name, defaults to the current buffer\n"
+            "  count: number of entries to show",
+            "suggest",
+        )
+        self.tracker = tracker
+        self.exclude = exclude if exclude is not None else ()
+
+    def callback(self, data: str, buffer: str, args: str) -> int:
+        words = args.split()
+        suggest = words[:1] == ["suggest"]
+        if suggest:
+            words = words[1:]
+
+        count = 10
+        if words and words[-1].isdigit():
+            count = int(words.pop())
+        if len(words) > 1:
+            return ReturnCode.ERROR.value
+        channel = words[0] if words else w.buffer_get_string(buffer, "full_name")
+
+        if suggest:
+            found = self.tracker.suggest(channel, self.exclude, count)
+            w.prnt(
+                buffer,
+                "untracked commands trending in {}: {}".format(
+                    channel, " ".join(found) or "none"
+                ),
+            )
+            return ReturnCode.OK.value
+
+        w.prnt(buffer, "trending in {}:".format(channel))
+        for token, weight, error in self.tracker.top(channel, count):
+            w.prnt(buffer, "  {:<24} {:>8.1f} (±{:.1f})".format(token, weight, error))
+        return ReturnCode.OK.value
@@ -247,4 +247,169 @@ def hook_modifier(modifier: str, callback: str, callback_data: str):
         modifier (str): The modifier to hook
         callback (str): The name of the function to call
         callback_data (str): Arbitrary data to pass to the callback
-    """
\ No newline at end of file
+    """
+
+def hook_config(option: str, callback: str, callback_data: str) -> str:
+    """Hook changes to configuration options
+
+    Args:
+        option (str): Option to watch, wildcard * is allowed (e.g. "plugins.var.python.myscript.*")
+        callback (str): The name of the function to call with (data, option, value)
+        callback_data (str): Arbitrary data to pass to the callback
+
+    Returns:
+        str: Pointer to the installed hook
+    """
+    return ""
+
+
+def config_get_plugin(option: str) -> str:
+    """Get the value of a script option (plugins.var.python.<script>.<option>)
+
+    Args:
+        option (str): Option name, without the plugins.var prefix
+
+    Returns:
+        str: Value of the option, "" if not found
+    """
+    return ""
+
+
+def config_is_set_plugin(option: str) -> int:
+    """Check if a script option is set
+
+    Args:
+        option (str): Option name, without the plugins.var prefix
+
+    Returns:
+        int: 1 if the option is set, 0 otherwise
+    """
+    return 0
+
+
+def config_set_plugin(option: str, value: str) -> int:
+    """Set the value of a script option, creating it if needed
+
+    Args:
+        option (str): Option name, without the plugins.var prefix
+        value (str): New value
+
+    Returns:
+        int: One of the WEECHAT_CONFIG_OPTION_SET_* codes
+    """
+    return -1
+
+
+def config_set_desc_plugin(option: str, description: str):
+    """Set the description of a script option
+
+    Args:
+        option (str): Option name, without the plugins.var prefix
+        description (str): Description, displayed in /help and /set
+    """
+    pass
+
+
+def info_get(info_name: str, arguments: str) -> str:
+    """Get information about WeeChat or a plugin
+
+    Args:
+        info_name (str): Name of the info to read, e.g. "weechat_data_dir"
+        arguments (str): Arguments for the info (optional)
+
+    Returns:
+        str: The requested info, "" if not found
+    """
+    return ""
+
+
+def hook_fd(
+    fd: int,
+    flag_read: int,
+    flag_write: int,
+    flag_exception: int,
+    callback: str,
+    callback_data: str,
+) -> str:
+    """Hook a file descriptor (file or socket)
+
+    Args:
+        fd (int): File descriptor to watch
+        flag_read (int): 1 to catch read events, 0 to ignore
+        flag_write (int): 1 to catch write events, 0 to ignore
+        flag_exception (int): 1 to catch exception events, 0 to ignore (ignored since WeeChat 1.3)
+        callback (str): The name of the function to call with (data, fd)
+        callback_data (str): Arbitrary data to pass to the callback
+
+    Returns:
+        str: Pointer to the installed hook
+    """
+    return ""
+
+
+def hook_bar_item(name: str, callback: str, callback_data: str) -> str:
+    """Create a bar item whose content is built by a callback
+
+    Args:
+        name (str): Name of the bar item
+        callback (str): The name of the function to call with (data, item,
+            window, buffer, extra_info); it returns the content to display
+        callback_data (str): Arbitrary data to pass to the callback
+
+    Returns:
+        str: Pointer to the new bar item
+    """
+    return ""
+
+
+def bar_item_update(name: str):
+    """Refresh the content of a bar item in every window where it's displayed
+
+    Args:
+        name (str): Name of the bar item
+    """
+
+
+def bar_item_search(name: str) -> str:
+    """Find a bar item
+
+    Args:
+        name (str): Name of the bar item
+
+    Returns:
+        str: Pointer to the bar item, "" if not found
+    """
+    return ""
+
+
+def bar_item_remove(item: str):
+    """Remove a bar item
+
+    Args:
+        item (str): Pointer to the bar item
+    """
+
+
+def buffer_get_string(buffer: str, property: str) -> str:
+    """Get a string property of a buffer
+
+    Args:
+        buffer (str): Pointer to the buffer
+        property (str): Property name, e.g. "full_name" or "localvar_channel"
+
+    Returns:
+        str: Value of the property
+    """
+    return ""
+
+
+def config_get(option_name: str) -> str:
+    """Find an option by its full name
+
+    Args:
+        option_name (str): Full option name, e.g. "irc.server.libera.addresses"
+
+    Returns:
+        str: Pointer to the option, "" if not found
+    """
+    return ""
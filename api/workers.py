@@ -0,0 +1,295 @@
+import json
+import os
+import struct
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from time import sleep
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import weechat as w
+
+from api import IrcMessage, ReturnCode, assert_named_correctly
+
+# shared memory layout: head (u64), tail (u64), stop flag (u64), then the ring
+_HEADER = struct.Struct("<QQQ")
+_DATA = _HEADER.size
+_STOP = 16
+
+# every record starts with its total length and type; the length is written
+# last so a reader never sees a record whose body isn't there yet
+_RECORD = struct.Struct("<IB")
+_PAD = 0
+_EVENT = 1
+_DEFINE = 2
+_CLEAR = 3
+_EVENT_IDS = struct.Struct("<IIII")
+_DEFINE_ID = struct.Struct("<I")
+
+
+class ChatEvent(NamedTuple):
+    server: str
+    command: str
+    channel: str
+    nick: str
+    text: str
+
+
+class Ring:
+    """Single-producer, single-consumer byte ring over a shared memory buffer"""
+
+    def __init__(self, buf: memoryview):
+        self.buf = buf
+        self.capacity = len(buf) - _DATA
+        self.tail = 0
+
+    def write(self, records: List[Tuple[int, bytes]]) -> bool:
+        """Append all records, or none of them if they don't fit"""
+        buf = self.buf
+        cap = self.capacity
+        head, tail = struct.unpack_from("<QQ", buf, 0)
+
+        pos = head
+        for _, payload in records:
+            length = _RECORD.size + len(payload)
+            room = cap - pos % cap
+            if room < length:
+                pos += room
+            pos += length
+        if pos - tail > cap:
+            return False
+
+        pos = head
+        for type, payload in records:
+            length = _RECORD.size + len(payload)
+            off = pos % cap
+            room = cap - off
+            if room < length:
+                if room >= _RECORD.size:
+                    _RECORD.pack_into(buf, _DATA + off, room, _PAD)
+                pos += room
+                off = 0
+            start = _DATA + off + _RECORD.size
+            buf[start : start + len(payload)] = payload
+            _RECORD.pack_into(buf, _DATA + off, length, type)
+            pos += length
+
+        struct.pack_into("<Q", buf, 0, pos)
+        return True
+
+    def read(self) -> Iterator[Tuple[int, bytes]]:
+        buf = self.buf
+        cap = self.capacity
+        head = struct.unpack_from("<Q", buf, 0)[0]
+        tail = self.tail
+        try:
+            while tail < head:
+                off = tail % cap
+                room = cap - off
+                if room < _RECORD.size:
+                    tail += room
+                    continue
+
+                length, type = _RECORD.unpack_from(buf, _DATA + off)
+                if length == 0:
+                    break
+
+                start = _DATA + off + _RECORD.size
+                payload = bytes(buf[start : _DATA + off + length])
+                _RECORD.pack_into(buf, _DATA + off, 0, _PAD)
+                tail += length
+                if type != _PAD:
+                    yield type, payload
+        finally:
+            self.tail = tail
+            struct.pack_into("<Q", buf, 8, tail)
+
+    @property
+    def stopped(self) -> bool:
+        return struct.unpack_from("<Q", self.buf, _STOP)[0] != 0
+
+    def stop(self):
+        struct.pack_into("<Q", self.buf, _STOP, 1)
+
+
+class Shard:
+    """The parent's side of one worker: its ring, interned strings and result pipe"""
+
+    def __init__(self, ring_size: int, max_interned: int):
+        self.shm = SharedMemory(create=True, size=_DATA + ring_size)
+        buf = self.shm.buf
+        assert buf is not None, "shared memory isn't mapped"
+        buf[:_DATA] = bytes(_DATA)
+        self.ring = Ring(buf)
+        self.ids: Dict[str, int] = {}
+        self.next_id = 0
+        self.max_interned = max_interned
+        self.read_fd, self.write_fd = os.pipe()
+        self.pending = b""
+        self.process: Any = None
+        self.hook: Optional[str] = None
+
+    def push(self, server: str, command: str, channel: str, nick: str, text: str):
+        ids = self.ids
+        if len(ids) > self.max_interned:
+            if not self.ring.write([(_CLEAR, b"")]):
+                return False
+            ids.clear()
+            self.next_id = 0
+
+        records: List[Tuple[int, bytes]] = []
+        new: Dict[str, int] = {}
+        keys = []
+        for s in (server, command, channel, nick):
+            key = ids.get(s)
+            if key is None:
+                key = new.get(s)
+            if key is None:
+                key = new[s] = self.next_id + len(new)
+                records.append((_DEFINE, _DEFINE_ID.pack(key) + s.encode()))
+            keys.append(key)
+
+        records.append((_EVENT, _EVENT_IDS.pack(*keys) + text.encode()))
+        if not self.ring.write(records):
+            return False
+
+        ids.update(new)
+        self.next_id += len(new)
+        return True
+
+
+def _work(ring: Ring, analyze: Callable[[ChatEvent], Any], result_fd: int):
+    parent = os.getppid()
+    strings: Dict[int, str] = {}
+    idle = 0.001
+    while not ring.stopped and os.getppid() == parent:
+        seen = False
+        for type, payload in ring.read():
+            seen = True
+            if type == _EVENT:
+                server, command, channel, nick = _EVENT_IDS.unpack_from(payload)
+                result = analyze(
+                    ChatEvent(
+                        strings[server],
+                        strings[command],
+                        strings[channel],
+                        strings[nick],
+                        payload[_EVENT_IDS.size :].decode(errors="replace"),
+                    )
+                )
+                if result is not None:
+                    out = (json.dumps(result, separators=(",", ":")) + "\n").encode()
+                    while out:
+                        out = out[os.write(result_fd, out) :]
+            elif type == _DEFINE:
+                strings[_DEFINE_ID.unpack_from(payload)[0]] = payload[
+                    _DEFINE_ID.size :
+                ].decode(errors="replace")
+            elif type == _CLEAR:
+                strings.clear()
+
+        if seen:
+            idle = 0.001
+        else:
+            sleep(idle)
+            idle = min(idle * 2, 0.05)
+
+
+class WorkerPool:
+    """Fans chat events out to worker processes through shared memory rings
+
+    Each worker owns one ring and receives the channels that hash to it, so
+    per-channel analysis sees every message of its channels in order. Events
+    are encoded as interned string ids plus the message text; there is no
+    pickling on the way in. Whatever `analyze` returns (if not None) is sent
+    back as JSON over a pipe watched by hook_fd and passed to `on_result`.
+
+    If a ring is full the event is dropped and counted rather than blocking
+    WeeChat.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[ChatEvent], Any],
+        on_result: Callable[[Any], None],
+        workers: int = max((os.cpu_count() or 2) - 1, 1),
+        ring_size: int = 1 << 20,
+        max_interned: int = 1 << 16,
+    ):
+        self.analyze = analyze
+        self.on_result = on_result
+        self.workers = workers
+        self.ring_size = ring_size
+        self.max_interned = max_interned
+        self.shards: List[Shard] = []
+        self.dropped = 0
+
+    def callback(self, callback_name: str) -> Callable[[str, str], int]:
+        """Start the workers and watch their result pipes
+
+        The returned function must be stored in the script's global scope under
+        `callback_name`.
+        """
+        assert not self.shards, "WorkerPool already started"
+        assert_named_correctly(callback_name)
+
+        ctx = get_context("fork")
+        for _ in range(self.workers):
+            shard = Shard(self.ring_size, self.max_interned)
+            shard.process = ctx.Process(
+                target=_work,
+                args=(shard.ring, self.analyze, shard.write_fd),
+                daemon=True,
+            )
+            shard.process.start()
+            os.close(shard.write_fd)
+            self.shards.append(shard)
+
+        for idx, shard in enumerate(self.shards):
+            shard.hook = w.hook_fd(shard.read_fd, 1, 0, 0, callback_name, str(idx))
+        return self._callback
+
+    def push(self, server: str, command: str, channel: str, nick: str, text: str):
+        shard = self.shards[hash(channel) % len(self.shards)]
+        if not shard.push(server, command, channel, nick, text):
+            self.dropped += 1
+
+    def push_message(self, msg: IrcMessage):
+        """Queue a PRIVMSG-like message: params[0] is the channel, the last the text"""
+        self.push(
+            msg.server,
+            msg.command,
+            msg.params[0] if msg.params else "",
+            msg.nick or "",
+            msg.params[-1] if len(msg.params) > 1 else "",
+        )
+
+    def _callback(self, data: str, fd: str) -> int:
+        shard = self.shards[int(data)]
+        chunk = os.read(shard.read_fd, 65536)
+        if not chunk:
+            if shard.hook is not None:
+                w.unhook(shard.hook)
+                shard.hook = None
+            return ReturnCode.OK.value
+
+        lines = (shard.pending + chunk).split(b"\n")
+        shard.pending = lines.pop()
+        for line in lines:
+            self.on_result(json.loads(line))
+        return ReturnCode.OK.value
+
+    def stop(self, timeout: float = 1.0):
+        """Stop the workers and release the shared memory"""
+        for shard in self.shards:
+            shard.ring.stop()
+        for shard in self.shards:
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            if shard.hook is not None:
+                w.unhook(shard.hook)
+            os.close(shard.read_fd)
+            shard.ring.buf.release()
+            shard.shm.close()
+            shard.shm.unlink()
+        self.shards.clear()
@@ -0,0 +1,11 @@
+"""Micro-benchmarks for the api hot paths
+
+Run from the repository root:
+
+    python -m bench                 # compare against bench/baseline.json
+    python -m bench --save          # record a new baseline
+    python -m bench -k Glob -k Irc  # only run matching cases
+    python -m bench --imports       # list the slowest imports of api
+
+The import:* cases time imports in fresh interpreters with -X importtime.
+"""
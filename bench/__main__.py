@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Dict, List
+
+from bench import standin
+
+standin.install()
+
+from bench.cases import CASES  # noqa: E402
+from bench import imports  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def measure(make, repeat: int, budget: float) -> float:
+    """Return the best observed time per call, in nanoseconds"""
+    fn = make()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(int(number * budget / 0.2), 1)
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def report(results: Dict[str, float], baseline: Dict[str, float], threshold: float):
+    regressions = 0
+    width = max(len(name) for name in results)
+    for name, ns in results.items():
+        line = "{:<{}}  {:>10.0f} ns".format(name, width, ns)
+        base = baseline.get(name)
+        if base:
+            change = (ns - base) / base * 100
+            status = ""
+            if change > threshold:
+                status = "  REGRESSION"
+                regressions += 1
+            elif change < -threshold:
+                status = "  improved"
+            line += "  {:>+7.1f}% vs {:.0f} ns{}".format(change, base, status)
+        print(line)
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("-k", action="append", default=[], help="run matching cases")
+    parser.add_argument("--save", action="store_true", help="write a new baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget", type=float, default=0.2, help="seconds per repeat, roughly"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="percent change to report"
+    )
+    parser.add_argument(
+        "--imports", action="store_true", help="list the slowest imports of api"
+    )
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        print("{:<40}  {:>10}  {:>10}".format("module", "self us", "cumul us"))
+        for name, own, cumulative in imports.slowest("import api"):
+            print("{:<40}  {:>10}  {:>10}".format(name, own, cumulative))
+        return 0
+
+    def selected(name: str) -> bool:
+        return not args.k or any(k in name for k in args.k)
+
+    results = {
+        name: measure(make, args.repeat, args.budget)
+        for name, make in CASES
+        if selected(name)
+    }
+    for name, snippet, module in imports.IMPORTS:
+        if selected(name):
+            results[name] = imports.measure(snippet, module, args.repeat)
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": {**baseline, **results},
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print("saved baseline to {}".format(args.baseline))
+        return 0
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+from typing import Callable, Dict, List, Tuple
+
+import api
+from api import (
+    Glob,
+    Irc,
+    RegExp,
+    ReturnCode,
+    String,
+    TwitchIrc,
+    TwitchMessage,
+    get_message,
+    match_array,
+    set_timeout,
+)
+
+Case = Tuple[str, Callable[[], Callable[[], object]]]
+
+PRIVMSG = (
+    "@badge-info=subscriber/14;badges=moderator/1,subscriber/12,bits/1000;"
+    "client-nonce=3c1e3e7a0c1b4f0b9d6f3f2e4b5a6c7d;color=#1E90FF;"
+    "display-name=SomeViewer;emotes=25:0-4,12-16/1902:6-10;first-msg=0;"
+    "flags=;id=5f1a6e1c-2d3b-4c5d-8e9f-0a1b2c3d4e5f;mod=1;returning-chatter=0;"
+    "room-id=12345678;subscriber=1;tmi-sent-ts=1650000000000;turbo=0;"
+    "user-id=87654321;user-type=mod "
+    ":someviewer!someviewer@someviewer.tmi.twitch.tv PRIVMSG #dunkorslam "
+    ":Kappa Keepo Kappa !speen"
+)
+SIGNAL = "twitch,irc_raw_in_PRIVMSG"
+HTABLE = {
+    "buffer": "0x55d0c0ffee00",
+    "buffer_name": "irc.twitch.#dunkorslam",
+    "buffer_type": "formatted",
+    "y": "-1",
+    "date": "1650000000",
+    "date_printed": "1650000000",
+    "str_time": "\x19\x3102\x1c:\x19\x3103\x1c:\x19\x3104",
+    "tags": "irc_privmsg,irc_tag_id=5f1a,notify_message,prefix_nick_lightblue,"
+    "nick_someviewer,host_someviewer@someviewer.tmi.twitch.tv,log1",
+    "displayed": "1",
+    "notify_level": "1",
+    "highlight": "0",
+    "prefix": "\x19F12someviewer",
+    "message": "Kappa Keepo Kappa !speen",
+}
+PARAMS = ["#dunkorslam", "Kappa Keepo Kappa !speen"]
+
+
+def parse_irc():
+    return lambda: api.IrcMessage("twitch", PRIVMSG)
+
+
+def parse_twitch():
+    return lambda: TwitchMessage("twitch", PRIVMSG)
+
+
+def serialize_unmodified():
+    msg = TwitchMessage("twitch", PRIVMSG)
+    return lambda: str(msg)
+
+
+def serialize_modified():
+    msg = TwitchMessage("twitch", PRIVMSG)
+    msg.params[1] = "rewritten"
+    return lambda: str(msg)
+
+
+def match_string():
+    m = String("#dunkorslam")
+    return lambda: m.matches("#dunkorslam")
+
+
+def match_string_casemapped():
+    m = String("#DunkOrSlam", "rfc1459")
+    return lambda: m.matches("#dunkorslam")
+
+
+def match_regexp():
+    m = RegExp(r"!(speen|uguu|quack|croak)\b.*")
+    return lambda: m.matches(PARAMS[1])
+
+
+def match_glob():
+    m = Glob("*!speen*")
+    return lambda: m.matches(PARAMS[1])
+
+
+def match_array_mixed():
+    spec = [String("#dunkorslam"), Glob("*!speen*")]
+    return lambda: match_array(spec, PARAMS)
+
+
+def _handler(server, msg):
+    return ReturnCode.OK
+
+
+def dispatch_unhandled():
+    irc = TwitchIrc()
+    irc.on(_handler, "WHISPER")
+    return lambda: irc._callback("", SIGNAL, PRIVMSG)
+
+
+def dispatch_filtered():
+    irc = TwitchIrc()
+    for channel in ("#a", "#b", "#c", "#d"):
+        irc.on(_handler, "PRIVMSG", [channel, Glob("!*")])
+    return lambda: irc._callback("", SIGNAL, PRIVMSG)
+
+
+def dispatch_matched():
+    irc = TwitchIrc()
+    irc.on(_handler, "PRIVMSG", ["#dunkorslam"])
+    irc.on(_handler, "PRIVMSG", ["#dunkorslam", Glob("*!speen*")])
+    return lambda: irc._callback("", SIGNAL, PRIVMSG)
+
+
+def dispatch_plain_irc():
+    irc = Irc(casemapping="rfc1459")
+    irc.on(_handler, "PRIVMSG", ["#dunkorslam"])
+    return lambda: irc._callback("", SIGNAL, PRIVMSG)
+
+
+def dispatch_exact():
+    irc = Irc()
+    irc.on(_handler, "PRIVMSG", ["#dunkorslam"])
+    return lambda: irc._callback("", SIGNAL, PRIVMSG)
+
+
+def metrics_irc():
+    metrics = api.Metrics()
+    return lambda: metrics.irc("twitch", "PRIVMSG", PRIVMSG)
+
+
+def trending_add():
+    from itertools import cycle
+
+    from api.trending import SpaceSaving
+
+    sketch = SpaceSaving(200)
+    tokens = cycle("t{}".format(i * 7 % 500) for i in range(4096))
+    return lambda: sketch.add(next(tokens))
+
+
+def line_get_message():
+    return lambda: get_message(HTABLE)
+
+
+def timeout_set_cancel():
+    return lambda: set_timeout(20000, lambda remaining: None)()
+
+
+CASES: List[Case] = [
+    ("IrcMessage.parse", parse_irc),
+    ("TwitchMessage.parse", parse_twitch),
+    ("IrcMessage.str.unmodified", serialize_unmodified),
+    ("IrcMessage.str.modified", serialize_modified),
+    ("String.matches", match_string),
+    ("String.matches.casemapped", match_string_casemapped),
+    ("RegExp.matches", match_regexp),
+    ("Glob.matches", match_glob),
+    ("match_array", match_array_mixed),
+    ("Irc._callback.unhandled", dispatch_unhandled),
+    ("Irc._callback.filtered", dispatch_filtered),
+    ("Irc._callback.matched", dispatch_matched),
+    ("Irc._callback.plain", dispatch_plain_irc),
+    ("Irc._callback.exact", dispatch_exact),
+    ("Metrics.irc", metrics_irc),
+    ("SpaceSaving.add", trending_add),
+    ("get_message", line_get_message),
+    ("set_timeout", timeout_set_cancel),
+]
@@ -0,0 +1,59 @@
+"""Import-time cases, measured in fresh interpreters with `-X importtime`
+
+Each case runs a snippet after installing the weechat stand-in and reports
+the cumulative import time of one module, so the cost of the stand-in and
+of the interpreter itself is excluded.
+"""
+
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRELUDE = "from bench import standin; standin.install(); "
+
+# (case name, snippet, module whose cumulative time is reported)
+IMPORTS: List[Tuple[str, str, str]] = [
+    ("import:api", "import api", "api"),
+    ("import:scripts.counter", "import scripts.counter", "scripts.counter"),
+    (
+        "import:api.parsing",
+        "import api; api.IrcMessage('', ':a!b@c PRIVMSG #d :e')",
+        "api.parsing",
+    ),
+]
+
+
+def import_times(snippet: str) -> Dict[str, Tuple[int, int, int]]:
+    """Run `snippet` and return (self us, cumulative us, depth) by module"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PRELUDE + snippet],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    times: Dict[str, Tuple[int, int, int]] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.setdefault(name.strip(), (int(own), int(cumulative), depth))
+    return times
+
+
+def measure(snippet: str, module: str, repeat: int) -> float:
+    """Return the best cumulative import time of `module`, in nanoseconds"""
+    best = min(import_times(snippet)[module][1] for _ in range(repeat))
+    return best * 1e3
+
+
+def slowest(snippet: str, count: int = 15) -> List[Tuple[str, int, int]]:
+    """The `count` imports with the highest self time, as (name, self, cumulative)"""
+    times = import_times(snippet)
+    ranked = sorted(times.items(), key=lambda item: item[1][0], reverse=True)
+    return [(name, own, cum) for name, (own, cum, _) in ranked[:count]]
@@ -0,0 +1,55 @@
+"""A stand-in for the `weechat` module, so `api` can be imported outside WeeChat
+
+Unlike the editor stubs in api/weechat.py, hooks return distinct pointers and
+`string_remove_color` returns its input, so code paths behave as they would
+inside WeeChat minus the C side.
+"""
+
+import sys
+import types
+from itertools import count
+from typing import Any, Dict
+
+_pointers = count(1)
+
+
+def _hook(*args) -> str:
+    return "0x{:x}".format(next(_pointers))
+
+
+_ATTRIBUTES: Dict[str, Any] = {
+    "WEECHAT_RC_OK": 0,
+    "WEECHAT_RC_OK_EAT": 1,
+    "WEECHAT_RC_ERROR": -1,
+    "register": lambda *args: 1,
+    "prnt": lambda buffer, text: None,
+    "hook_command": _hook,
+    "hook_line": _hook,
+    "hook_print": _hook,
+    "hook_timer": _hook,
+    "hook_signal": _hook,
+    "hook_modifier": _hook,
+    "hook_config": _hook,
+    "hook_fd": _hook,
+    "unhook": lambda ptr: None,
+    "unhook_all": lambda: None,
+    "string_remove_color": lambda text, replacement: text,
+    "command": lambda buffer, text: 0,
+    "buffer_search": lambda plugin, name: "0x1",
+    "info_get": lambda name, args: "",
+    "config_get_plugin": lambda name: "",
+    "config_is_set_plugin": lambda name: 0,
+    "config_set_plugin": lambda name, value: 0,
+    "config_set_desc_plugin": lambda name, desc: None,
+}
+
+
+def install() -> types.ModuleType:
+    if "weechat" in sys.modules:
+        return sys.modules["weechat"]
+
+    w = types.ModuleType("weechat")
+    for name, value in _ATTRIBUTES.items():
+        setattr(w, name, value)
+    sys.modules["weechat"] = w
+    return w
@@ -1,19 +1,15 @@
-from typing import Any, Dict, List, Set
+from typing import Any, Dict, List
 from datetime import datetime, timedelta
-from pprint import pformat, pprint
+from time import time
 from api import (
-    Glob,
-    IrcMessage,
-    MessageTag,
+    Config,
     Script,
     Command,
     Message,
     Event,
+    LineFilter,
     ReturnCode,
-    TwitchIrc,
-    TwitchMessage,
     prnt,
-    timer_callback,
     set_timeout,
     say,
     # irc_raw_in_cb,
@@ -21,32 +17,99 @@ from api import (
 
 
 def irc_in2_privmsg_cb(*args):
+    from pprint import pformat
+
     prnt("", pformat(args))
     return ReturnCode.OK
 
 
+class CounterConfig(Config):
+    def __init__(self):
+        super().__init__(
+            buffer=("irc.twitch.#dunkorslam", "Buffer to watch for commands"),
+            commands=(
+                ["!uguu", "!quack", "!croak", "!speen"],
+                "Comma-separated list of commands to track",
+            ),
+            window=(20000, "Milliseconds without a command before it is reported"),
+            cooldown=(600, "Seconds to ignore a command after a combo"),
+            threshold=(10, "Number of unique users that makes a combo"),
+        )
+
+
 class CommandTracker(Event):
-    def __init__(self, *commands: str):
-        self.commands: Dict[str, Dict[str, Any]] = {
-            k: {
-                "next_allowed": datetime.now(),
-                "users": set(),
-                "timer": None,
+    def __init__(self, config: Config):
+        self.config = config
+        self.commands: Dict[str, Dict[str, Any]] = {}
+        self.set_commands(config["commands"])
+        config.watch(self.configure)
+
+        super().__init__("", "", "", self.line_filter_for(config["buffer"]))
+
+    def line_filter_for(self, buffer: str) -> LineFilter:
+        # only plain chat messages whose first word is a tracked command reach
+        # the callback; everything but the first word is checked by WeeChat
+        return LineFilter(
+            buffers=[buffer],
+            commands=["privmsg"],
+            notify_levels=[1],
+            first_words=self.commands,
+        )
+
+    def configure(self, name: str, value: Any):
+        if name == "commands":
+            self.set_commands(value)
+            self.set_filter(self.line_filter_for(self.config["buffer"]))
+        elif name == "buffer":
+            self.set_filter(self.line_filter_for(value))
+
+    def set_commands(self, commands: List[str]):
+        for command in list(self.commands):
+            if not command in commands:
+                self.clear_timeout(command)
+                del self.commands[command]
+
+        for command in commands:
+            if not command in self.commands:
+                self.commands[command] = {
+                    "next_allowed": datetime.now(),
+                    "users": set(),
+                    "timer": None,
+                    "deadline": None,
+                }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            command: {
+                "next_allowed": state["next_allowed"].timestamp(),
+                "users": sorted(state["users"]),
+                "deadline": state["deadline"],
             }
-            for k in commands
+            for command, state in self.commands.items()
         }
 
-        super().__init__("", "irc.twitch.#dunkorslam", "")
+    def restore(self, state: Dict[str, Any]):
+        for command, saved in state.items():
+            if not command in self.commands:
+                continue
 
-    def callback(self, msg: Message):
-        if not msg.notify_level == 1:
-            return
+            self.commands[command]["next_allowed"] = datetime.fromtimestamp(
+                saved["next_allowed"]
+            )
+            if saved["deadline"] is None:
+                continue
 
-        m = msg.message2
-        if not m.startswith("!"):
-            return
+            # a window that closed long before the reload is stale; reporting it
+            # now would announce a combo nobody saw
+            remaining = int((saved["deadline"] - time()) * 1000)
+            if remaining < -self.config["window"]:
+                continue
+
+            self.commands[command]["users"].update(saved["users"])
+            self.schedule(command, max(remaining, 1))
 
-        firstword = m.split(" ")[0]
+    def callback(self, msg: Message):
+        firstword = msg.message2.split(" ")[0]
         if not firstword in self.commands:
             return
 
@@ -58,9 +121,12 @@ class CommandTracker(Event):
     def reset(self, command: str, cooldown: bool):
         # prnt("", f"resetting {command = }")
         if cooldown:
-            self.commands[command]["next_allowed"] = datetime.now() + timedelta(0, 600)
+            self.commands[command]["next_allowed"] = datetime.now() + timedelta(
+                0, self.config["cooldown"]
+            )
 
         self.commands[command]["users"].clear()
+        self.commands[command]["deadline"] = None
         self.clear_timeout(command)
 
     def clear_timeout(self, command):
@@ -71,18 +137,22 @@ class CommandTracker(Event):
     def report(self, command):
         uniq = len(self.commands[command]["users"])
         prnt("", f"{command = } {uniq = }")
-        if uniq >= 10:
+        if uniq >= self.config["threshold"]:
             self.reset(command, True)
-            say("irc.twitch.#dunkorslam", f"{uniq} {command} combo! dnkWTF")
+            say(self.buffer_name, f"{uniq} {command} combo! dnkWTF")
         else:
             self.reset(command, False)
 
     def touch(self, command, user):
         # prnt("", f"touch {user = } {command = }")
         self.commands[command]["users"].add(user)
+        self.schedule(command, self.config["window"])
+
+    def schedule(self, command: str, delay: int):
         self.clear_timeout(command)
+        self.commands[command]["deadline"] = time() + delay / 1000
         self.commands[command]["timer"] = set_timeout(
-            20000, lambda x: self.report(command)
+            delay, lambda x: self.report(command)
         )
 
 
@@ -116,9 +186,9 @@ class Counter(Script):
 
 #     # irc_cb = irc.callback("irc_cb")
 
-#     commandtracker_cb = counter.register_event(
-#         CommandTracker("!uguu", "!quack", "!croak", "!speen")
-#     )
+#     counter_config = CounterConfig()
+#     counterconfig_cb = counter.register_config(counter_config)
+#     commandtracker_cb = counter.register_event(CommandTracker(counter_config))
 #     counter_shutdown = counter.shutdown
 #     counter.install()
 
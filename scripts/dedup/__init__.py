@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import List
+from api import Event, Message, MessageTag
+
+
+class DuplicateFilter(Event):
+    """Collapses bursts of identical chat lines in a buffer
+
+    Lines are keyed on their normalized text and tracked in a bounded LRU. The
+    first occurrence within `window_ms` is displayed as-is; repeats are deleted.
+    With `fold` enabled, a repeat is shown with a "×N" counter every time the
+    count doubles so the size of the burst stays visible.
+    """
+
+    def __init__(
+        self,
+        buffer_name: str,
+        window_ms: int = 5000,
+        max_entries: int = 1024,
+        fold: bool = True,
+    ):
+        self.window = window_ms / 1000
+        self.max_entries = max_entries
+        self.fold = fold
+        self.seen: "OrderedDict[int, List]" = OrderedDict()
+
+        super().__init__("formatted", buffer_name, MessageTag.IRC("privmsg"))
+
+    def callback(self, msg: Message):
+        text = msg.message2.replace("\U000e0000", "").lower()
+        key = hash((msg.buffer_name, " ".join(text.split())))
+        now = monotonic()
+
+        entry = self.seen.get(key)
+        if entry is None or now - entry[0] > self.window:
+            self.seen[key] = [now, 1]
+            self.seen.move_to_end(key)
+            if len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+            return
+
+        self.seen.move_to_end(key)
+        entry[1] += 1
+        count = entry[1]
+        if self.fold and count & (count - 1) == 0:
+            msg.message = f"{msg.message} ×{count}"
+        else:
+            msg.delete()